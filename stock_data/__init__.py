@@ -1,9 +1,10 @@
 _calender = None
+_trading_days = None
 
 
 def create_calendar():
     from business_calendar import Calendar, MO, TU, WE, TH, FR
-    from stock_data.fill_data import open_session
+    from stock_data.database import open_session
     from stock_data.models import Holidays
 
     global _calender
@@ -19,5 +20,26 @@ def create_calendar():
     return _calender
 
 
+def create_trading_days():
+    from stock_data.database import open_session
+    from stock_data.models import Holidays
+    from stock_data.trading_days import TradingDays
+
+    global _trading_days
+    if _trading_days is None:
+        with open_session() as session:
+            holidays = [d[0] for d in session.query(Holidays.date).all()]
+        _trading_days = TradingDays(holidays)
+
+    return _trading_days
+
+
+def reset_calendars():
+    """Forget the cached calendars, the next use rebuilds them from the database."""
+    global _calender, _trading_days
+    _calender = None
+    _trading_days = None
+
+
 def convert_to_currency(value: float) -> float:
     return round(value + 0.0005, 2)
@@ -0,0 +1,129 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+import yfinance as yf
+
+from stock_data.bar_store import bar_store
+from stock_data.database import SYMBOLS_PER_QUERY
+from stock_data.models import Stock
+
+BENCHMARK = "SPY"
+# about three months of sessions, what Yahoo's averageVolume covers
+AVG_VOLUME_DAYS = 63
+# three years of daily returns, like Yahoo's beta3Year
+BETA_DAYS = 756
+# fewer overlapping returns than this and the symbol is looked up online
+MIN_BETA_OBSERVATIONS = 126
+
+
+def load_bar_frames(
+    dbsession, symbols, start: datetime.date, end: datetime.date
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Closes and volumes of symbols in [start, end], one column per symbol.
+
+    Both frames share a date index; days a symbol has no bar are NaN.
+    Symbols in the bar store are read from it, the rest from the database.
+    """
+    symbols = sorted(set(symbols))
+    frames = []
+    unstored = symbols
+    store = bar_store()
+    if store is not None:
+        stored = {symbol for symbol in symbols if store.has(symbol)}
+        for symbol in sorted(stored):
+            bars = store.read(symbol, start, end, ("date", "close", "volume"))
+            frames.append(pd.DataFrame(dict(bars, symbol=symbol)))
+        unstored = [symbol for symbol in symbols if symbol not in stored]
+
+    rows = []
+    for i in range(0, len(unstored), SYMBOLS_PER_QUERY):
+        rows.extend(
+            dbsession.query(Stock.date, Stock.symbol, Stock.close, Stock.volume)
+            .filter(
+                Stock.symbol.in_(unstored[i : i + SYMBOLS_PER_QUERY]),
+                Stock.date.between(start, end),
+            )
+            .all()
+        )
+    frames.append(pd.DataFrame(rows, columns=["date", "symbol", "close", "volume"]))
+    bars = pd.concat(frames, ignore_index=True)
+    bars["date"] = pd.to_datetime(bars["date"])
+    closes = bars.pivot_table(index="date", columns="symbol", values="close")
+    volumes = bars.pivot_table(index="date", columns="symbol", values="volume")
+    return (
+        closes.reindex(columns=symbols).sort_index(),
+        volumes.reindex(columns=symbols).sort_index(),
+    )
+
+
+def average_volumes(volumes: pd.DataFrame, days: int = AVG_VOLUME_DAYS) -> pd.Series:
+    """Mean volume over each symbol's last `days` stored sessions."""
+    return pd.Series(
+        {
+            symbol: column.dropna().iloc[-days:].mean()
+            for symbol, column in volumes.items()
+        },
+        dtype=float,
+    )
+
+
+def betas(
+    closes: pd.DataFrame,
+    benchmark: pd.Series,
+    days: int = BETA_DAYS,
+    min_observations: int = MIN_BETA_OBSERVATIONS,
+) -> pd.Series:
+    """Beta of every column of closes against benchmark over the last `days` returns.
+
+    Computed for all symbols at once: each symbol only uses the days both
+    it and the benchmark have a return, and is NaN with fewer than
+    min_observations of them.
+    """
+    benchmark = benchmark.reindex(closes.index)
+    returns = closes.pct_change(fill_method=None).to_numpy()[-days:]
+    market = benchmark.pct_change(fill_method=None).to_numpy()[-days:, None]
+
+    mask = ~np.isnan(returns) & ~np.isnan(market)
+    count = mask.sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        market = np.where(mask, market, np.nan)
+        returns = np.where(mask, returns, np.nan)
+        market_deviation = market - np.nansum(market, axis=0) / count
+        returns_deviation = returns - np.nansum(returns, axis=0) / count
+        covariance = np.nansum(market_deviation * returns_deviation, axis=0)
+        variance = np.nansum(market_deviation**2, axis=0)
+        beta = covariance / variance
+    beta[(count < min_observations) | (variance == 0)] = np.nan
+    return pd.Series(beta, index=closes.columns)
+
+
+def compute_asset_stats(
+    closes: pd.DataFrame, volumes: pd.DataFrame, benchmark: str = BENCHMARK
+) -> pd.DataFrame:
+    """avg_volume and beta per symbol; NaN where local history falls short.
+
+    The benchmark is a symbol like any other (SPY pays dividends), with its
+    own volume and a beta of 1.
+    """
+    symbols = list(closes.columns)
+    others = [symbol for symbol in symbols if symbol != benchmark]
+    if benchmark in symbols:
+        beta = betas(closes[others], closes[benchmark])
+        beta[benchmark] = 1.0
+    else:
+        beta = pd.Series(np.nan, index=others)
+    return pd.DataFrame(
+        {"avg_volume": average_volumes(volumes[symbols]), "beta": beta}
+    ).reindex(symbols)
+
+
+def yahoo_volume_and_beta(symbol: str) -> tuple[float, float]:
+    stock = yf.Ticker(symbol)
+    info = stock.info
+    if "averageVolume" in info:
+        avg_volume = info["averageVolume"]
+    else:
+        history = stock.history(period="2y")
+        avg_volume = history["Volume"].mean()
+    return avg_volume, info.get("beta3Year", info.get("beta", 0.0))
@@ -0,0 +1,90 @@
+import collections
+import os
+import threading
+import weakref
+
+from stock_data.simulation import SymbolBars, load_bars
+
+BAR_CACHE_MAX_BYTES = int(os.getenv("STOCK_DATA_BAR_CACHE_MB", 256)) * 1024 * 1024
+
+
+class BarCache:
+    """Full bar history of recently used symbols, least recently used evicted first.
+
+    A symbol's bars are loaded once and every point or range lookup after
+    that is answered from memory until fill_stock_data (through
+    upsert_stocks) writes bars for it. There is one cache per engine (see
+    bar_cache) in each process, writes made by other processes are not seen.
+    """
+
+    def __init__(self, max_bytes: int = BAR_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._bars = collections.OrderedDict()
+        self._bytes = 0
+        # bumped by invalidate, so a load racing a write is not kept
+        self._writes = collections.Counter()
+        self._lock = threading.Lock()
+
+    def get(self, dbsession, symbol: str) -> SymbolBars:
+        with self._lock:
+            bars = self._bars.get(symbol)
+            if bars is not None:
+                self._bars.move_to_end(symbol)
+                self.hits += 1
+                return bars
+            self.misses += 1
+            writes = self._writes[symbol]
+        bars = load_bars(dbsession, symbol)
+        with self._lock:
+            if symbol not in self._bars and writes == self._writes[symbol]:
+                self._bars[symbol] = bars
+                self._bytes += bars.nbytes
+            # the newest entry stays even when it alone exceeds the budget
+            while self._bytes > self.max_bytes and len(self._bars) > 1:
+                _symbol, evicted = self._bars.popitem(last=False)
+                self._bytes -= evicted.nbytes
+        return bars
+
+    def bars(self, dbsession, symbol: str, start=None, end=None) -> SymbolBars:
+        return self.get(dbsession, symbol).between(start, end)
+
+    def invalidate(self, symbols):
+        if isinstance(symbols, str):
+            symbols = [symbols]
+        with self._lock:
+            for symbol in symbols:
+                self._writes[symbol] += 1
+                bars = self._bars.pop(symbol, None)
+                if bars is not None:
+                    self._bytes -= bars.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._bars.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "symbols": len(self._bars),
+                "bytes": self._bytes,
+            }
+
+
+# one cache per engine, dropped together with it
+_caches = weakref.WeakKeyDictionary()
+_caches_lock = threading.Lock()
+
+
+def bar_cache(dbsession) -> BarCache:
+    """The cache of the database dbsession is bound to."""
+    engine = dbsession.get_bind().engine
+    with _caches_lock:
+        cache = _caches.get(engine)
+        if cache is None:
+            cache = _caches[engine] = BarCache()
+    return cache
@@ -0,0 +1,198 @@
+import datetime
+import logging
+import os
+import tempfile
+
+import numpy as np
+from sqlalchemy import func, select
+
+from stock_data.database import SYMBOLS_PER_QUERY
+from stock_data.models import Stock
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional, without it every read goes to the database
+    pa = pq = None
+
+BAR_STORE_DIR = os.getenv(
+    "STOCK_DATA_BAR_STORE_DIR",
+    # a sibling of the response cache, whose eviction would delete these files
+    os.path.join(os.path.expanduser("~"), ".cache", "backtest-data-bars"),
+)
+# readers only use the store when asked to, it is a snapshot of the last export
+BAR_STORE_ENABLED = os.getenv("STOCK_DATA_BAR_STORE", "off").lower() in (
+    "on",
+    "1",
+    "yes",
+)
+BAR_COLUMNS = ("date", "open", "high", "low", "close", "volume")
+
+
+def available() -> bool:
+    return pa is not None
+
+
+def symbol_path(directory: str, symbol: str) -> str:
+    return os.path.join(directory, symbol.replace("/", "_") + ".parquet")
+
+
+def invalidate(symbols, directory: str = None) -> int:
+    """Drop the files of symbols whose bars were just written to the database.
+
+    Reads fall back to the database until the next export writes them again.
+    Works without pyarrow, so a process that does not read the store still
+    keeps it from going stale. Returns the number of files removed.
+    """
+    if isinstance(symbols, str):
+        symbols = [symbols]
+    directory = directory or BAR_STORE_DIR
+    removed = 0
+    for symbol in symbols:
+        try:
+            os.remove(symbol_path(directory, symbol))
+            removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+class BarStore:
+    """Daily bars of each symbol in its own Parquet file, exported from stocks.
+
+    The database stays the write side: upsert_stocks drops the files of the
+    symbols it writes (see invalidate) and export() rewrites the files that
+    are missing or whose bar count or last date changed. Reads memory-map a
+    file and hand its columns back as NumPy arrays.
+    """
+
+    def __init__(self, directory: str = BAR_STORE_DIR):
+        if not available():
+            raise RuntimeError("the bar store needs pyarrow, pip install pyarrow")
+        self.directory = directory
+
+    def _path(self, symbol: str) -> str:
+        return symbol_path(self.directory, symbol)
+
+    def has(self, symbol: str) -> bool:
+        return os.path.exists(self._path(symbol))
+
+    def state(self, symbol: str):
+        """(rows, last_date) the symbol's file was exported with, or None."""
+        try:
+            metadata = pq.read_schema(self._path(symbol)).metadata or {}
+        except FileNotFoundError:
+            return None
+        return (
+            int(metadata[b"rows"]),
+            datetime.date.fromisoformat(metadata[b"last_date"].decode()),
+        )
+
+    def write(self, symbol: str, rows):
+        """Replace a symbol's file with rows of (date, open, high, low, close, volume)."""
+        columns = list(zip(*rows)) or [[] for _ in BAR_COLUMNS]
+        table = pa.table(
+            {
+                "date": pa.array(columns[0], type=pa.date32()),
+                **{
+                    name: pa.array(values, type=pa.float64())
+                    for name, values in zip(BAR_COLUMNS[1:], columns[1:])
+                },
+            }
+        )
+        last_date = max(columns[0]) if rows else datetime.date.min
+        table = table.replace_schema_metadata(
+            {"rows": str(len(rows)), "last_date": last_date.isoformat()}
+        )
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".parquet")
+        os.close(fd)
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, self._path(symbol))
+
+    def read(
+        self, symbol: str, start=None, end=None, columns=BAR_COLUMNS
+    ) -> dict[str, np.ndarray]:
+        """A symbol's bars in [start, end] as arrays, dates as datetime64[D]."""
+        table = pq.read_table(
+            self._path(symbol), columns=list(columns), memory_map=True
+        )
+        dates = table.column("date").to_numpy().astype("datetime64[D]")
+        first = 0 if start is None else np.searchsorted(dates, np.datetime64(start))
+        stop = (
+            len(dates)
+            if end is None
+            else np.searchsorted(dates, np.datetime64(end), side="right")
+        )
+        arrays = {
+            name: table.column(name).to_numpy()[first:stop]
+            for name in columns
+            if name != "date"
+        }
+        if "date" in columns:
+            arrays["date"] = dates[first:stop]
+        return arrays
+
+    def export(self, dbsession, symbols=None) -> int:
+        """Bring the files of symbols (all when None) in line with stocks.
+
+        One grouped query finds what changed; only those symbols are read
+        back, as plain rows. Returns the number of files written.
+        """
+        query = select(Stock.symbol, func.count(), func.max(Stock.date)).group_by(
+            Stock.symbol
+        )
+        if symbols is None:
+            counts = dbsession.execute(query).all()
+        else:
+            symbols = sorted(set(symbols))
+            counts = []
+            for i in range(0, len(symbols), SYMBOLS_PER_QUERY):
+                counts.extend(
+                    dbsession.execute(
+                        query.where(
+                            Stock.symbol.in_(symbols[i : i + SYMBOLS_PER_QUERY])
+                        )
+                    ).all()
+                )
+
+        written = 0
+        for symbol, rows, last_date in counts:
+            if self.state(symbol) == (rows, last_date):
+                continue
+            bars = dbsession.execute(
+                select(
+                    Stock.date,
+                    Stock.open,
+                    Stock.high,
+                    Stock.low,
+                    Stock.close,
+                    Stock.volume,
+                )
+                .where(Stock.symbol == symbol)
+                .order_by(Stock.date)
+            ).all()
+            self.write(symbol, bars)
+            written += 1
+        logging.info(
+            "Exported %s of %s symbols to %s", written, len(counts), self.directory
+        )
+        return written
+
+
+_store = None
+
+
+def bar_store():
+    """The configured store, or None when it is disabled or pyarrow is missing."""
+    global _store
+    if _store is None and BAR_STORE_ENABLED and available():
+        _store = BarStore()
+    return _store
+
+
+if __name__ == "__main__":
+    from stock_data.database import open_session
+
+    with open_session() as session:
+        BarStore().export(session)
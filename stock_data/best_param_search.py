@@ -1,144 +1,475 @@
 import datetime
 import logging
 import multiprocessing
+import os
+import signal
 
+import numpy as np
+import pandas as pd
+from scipy.optimize import minimize_scalar
+from sqlalchemy import func, insert, select
+
+import stock_data as sd
 import stock_data.risk_reward as rr
 import stock_data.fill_data as fd
 import stock_data.models as model
+import stock_data.simulation as sim
+from stock_data.bar_cache import bar_cache
+from stock_data.database import SYMBOLS_PER_QUERY, get_engine
+from stock_data.gap_planner import plan_window_download
+from stock_data.pipeline import checkpoint_for
 
 stop_loss_percentages = [r / 100 for r in range(10, 16, 1)]
+div_multipliers = [m / 4 for m in range(2, 25)]
+holding_days = [5]
 
 
 class DataLoadError(Exception):
     pass
 
 
+# what a failed backtest scores, far below any real portion_to_risk
+FAILED_SCORE = -1e6
+GOLDEN_RATIO = (np.sqrt(5) - 1) / 2
+
+
+class HeuristicSearch:
+    """The original walk: 1, 2, then up by 1 while portion_to_risk improves,
+    back 0.75 and up by 0.25 until it stops improving."""
+
+    def __init__(self, max_rounds=15):
+        self.max_rounds = max_rounds
+
+    def search(self, evaluate):
+        scores = []
+        multiplier, tune = 1, False
+        while multiplier is not None and len(scores) < self.max_rounds:
+            score = evaluate(multiplier)
+            if score is None:
+                return
+            scores.append(score)
+            if len(scores) == 1:
+                multiplier = 2
+                continue
+            improved = round(scores[-1] - scores[-2], 3) > 0
+            if improved:
+                multiplier += 0.25 if tune else 1
+            elif not tune:
+                tune = True
+                multiplier -= 0.75
+            else:
+                multiplier = None
+
+
+class GoldenSectionSearch:
+    """Golden-section search for the best multiplier in [low, high]."""
+
+    def __init__(self, low=0.5, high=6.0, tolerance=0.05, max_evaluations=30):
+        self.low = low
+        self.high = high
+        self.tolerance = tolerance
+        self.max_evaluations = max_evaluations
+
+    def search(self, evaluate):
+        def score(multiplier):
+            value = evaluate(multiplier)
+            return FAILED_SCORE if value is None else value
+
+        low, high = self.low, self.high
+        left = high - GOLDEN_RATIO * (high - low)
+        right = low + GOLDEN_RATIO * (high - low)
+        left_score, right_score = score(left), score(right)
+        evaluations = 2
+        while high - low > self.tolerance and evaluations < self.max_evaluations:
+            if left_score >= right_score:
+                high, right, right_score = right, left, left_score
+                left = high - GOLDEN_RATIO * (high - low)
+                left_score = score(left)
+            else:
+                low, left, left_score = left, right, right_score
+                right = low + GOLDEN_RATIO * (high - low)
+                right_score = score(right)
+            evaluations += 1
+
+
+class BoundedBrentSearch(GoldenSectionSearch):
+    """scipy's bounded Brent method, parabolic steps where the curve allows."""
+
+    def search(self, evaluate):
+        def loss(multiplier):
+            value = evaluate(multiplier)
+            return -(FAILED_SCORE if value is None else value)
+
+        minimize_scalar(
+            loss,
+            bounds=(self.low, self.high),
+            method="bounded",
+            options={"xatol": self.tolerance, "maxiter": self.max_evaluations},
+        )
+
+
+search_strategies = {
+    "heuristic": HeuristicSearch,
+    "golden": GoldenSectionSearch,
+    "brent": BoundedBrentSearch,
+}
+
+
 class DividendMultiplierSearch:
+    """Find a symbol's best div_multiplier with a pluggable search strategy.
 
-    def __init__(self, start_date, end_date):
-        self.checked = []
-        self.next = None
-        self.tune = False
+    Every backtest the strategy asks for is kept in memory (and only run
+    once per multiplier); the best one, or with store_intermediate all of
+    them, is written in one batch at the end.
+    """
+
+    def __init__(
+        self,
+        start_date,
+        end_date,
+        strategy=None,
+        stop_loss_percentage=stop_loss_percentages[0],
+        store_intermediate=False,
+        buy_days=5,
+    ):
         self.end_date = end_date
         self.start_date = start_date
+        if isinstance(strategy, str):
+            strategy = search_strategies[strategy]()
+        self.strategy = strategy or HeuristicSearch()
+        self.stop_loss_percentage = stop_loss_percentage
+        self.store_intermediate = store_intermediate
+        self.buy_days = buy_days
+        self.checked = []
 
-    def pick_next(self, session, asset):
-        num_of_rounds = len(self.checked)
-        if num_of_rounds == 0:
-            return 1
-        elif num_of_rounds == 1:
-            return 2
-        elif num_of_rounds >= 2 and num_of_rounds < 15:
-            risk_diff = get_risk_diffs(session, asset)
-            if risk_diff[0] > 0 and self.tune is False:
-                return self.next + 1
-            elif risk_diff[0] <= 0 and self.tune is False:
-                self.tune = True
-                return self.next - 0.75
-            elif risk_diff[0] > 0 and self.tune is True:
-                return self.next + 0.25
-            elif risk_diff[0] <= 0 and self.tune is True:
-                return None
-        return None
+    def backtest(self, session, asset, multiplier):
+        (
+            _win_rate,
+            loss_rate,
+            avg_gain,
+            avg_loss,
+            percentage_downloaded,
+            avg_dividend,
+            div_multiplier,
+            stop_loss_percentage,
+        ) = rr.backtest_security(
+            session,
+            self.start_date,
+            self.end_date,
+            asset,
+            self.buy_days,
+            multiplier,
+            self.stop_loss_percentage,
+        )
+        if _win_rate is None or not (avg_loss > 0 and avg_gain > 0):
+            logging.warning(
+                f"Could not calculate risk reward for {asset.symbol} with multiplier {multiplier}"
+            )
+            return None
+        return model.RiskReward(
+            symbol=asset.symbol,
+            win_rate=_win_rate,
+            avg_gain=avg_gain,
+            loss_rate=loss_rate,
+            avg_loss=avg_loss,
+            percentage_downloaded=percentage_downloaded,
+            avg_dividend=avg_dividend,
+            portion_to_risk=(_win_rate / avg_loss) - (loss_rate / avg_gain),
+            last_update=datetime.datetime.now(),
+            div_multiplier=div_multiplier,
+            stop_loss_percentage=stop_loss_percentage,
+        )
 
-    def find(self, symbol):
+    def search(self, session, asset) -> list:
+        """Unsaved RiskReward rows to store for asset, best first."""
         self.checked = []
-        self.tune = False
+        evaluations = {}
+
+        def evaluate(multiplier):
+            key = round(float(multiplier), 6)
+            if key not in evaluations:
+                self.checked.append(key)
+                evaluations[key] = self.backtest(session, asset, key)
+            entry = evaluations[key]
+            return None if entry is None else entry.portion_to_risk
+
+        self.strategy.search(evaluate)
+        entries = [entry for entry in evaluations.values() if entry is not None]
+        if not entries:
+            return []
+        entries.sort(key=lambda entry: entry.portion_to_risk, reverse=True)
+        logging.info(
+            "%s: best multiplier %s after %s backtests",
+            asset.symbol,
+            entries[0].div_multiplier,
+            len(evaluations),
+        )
+        return entries if self.store_intermediate else entries[:1]
+
+    def find(self, symbol):
         with fd.open_session() as session:
             asset = (
                 session.query(model.Assets)
                 .filter(model.Assets.symbol == symbol)
                 .first()
             )
-            self.next = self.pick_next(session, asset)
-            while self.next is not None:
-                self.checked.append(self.next)
-                (
-                    _win_rate,
-                    loss_rate,
-                    avg_gain,
-                    avg_loss,
-                    percentage_downloaded,
-                    avg_dividend,
-                    div_multiplier,
-                    stop_loss_percentage,
-                ) = rr.backtest_security(
-                    session,
-                    self.start_date,
-                    self.end_date,
-                    asset,
-                    5,
-                    self.next,
-                    stop_loss_percentages[0],
-                )
-                if _win_rate is not None and (avg_loss > 0 and avg_gain > 0):
-                    portion_to_risk = (_win_rate / avg_loss) - (loss_rate / avg_gain)
-                    risk_entry = model.RiskReward(
-                        symbol=asset.symbol,
-                        win_rate=_win_rate,
-                        avg_gain=avg_gain,
-                        loss_rate=loss_rate,
-                        avg_loss=avg_loss,
-                        percentage_downloaded=percentage_downloaded,
-                        avg_dividend=avg_dividend,
-                        portion_to_risk=portion_to_risk,
-                        last_update=datetime.datetime.now(),
-                        div_multiplier=div_multiplier,
-                        stop_loss_percentage=stop_loss_percentage,
-                    )
-                    session.add(risk_entry)
-                    session.commit()
-                else:
-                    logging.warning(
-                        f"Could not calculate risk reward for {asset.symbol} with multiplier {self.next}"
-                    )
-                    break
-                self.next = self.pick_next(session, asset)
-
-
-def risk_numbers(session, asset):
-    return list(
-        (
-            session.query(model.RiskReward)
-            .filter(model.RiskReward.symbol == asset.symbol)
-            .order_by(model.RiskReward.last_update.desc())
-            .all()
+            entries = self.search(session, asset)
+            if not entries:
+                return None
+            session.add_all(entries)
+            session.commit()
+            return entries[0]
+
+
+def grid_search(
+    session,
+    asset,
+    start,
+    end,
+    multipliers=div_multipliers,
+    stop_losses=stop_loss_percentages,
+    days_held=holding_days,
+    fill=True,
+) -> pd.DataFrame:
+    """Every multiplier x stop loss x holding period of a symbol, evaluated at once.
+
+    Each dividend is traded in its own window, computed from the ex-dividend
+    date for every holding period, so no events have to be stored. With fill
+    the bars missing from those windows are downloaded first, in one request.
+    """
+    dividends = (
+        session.query(model.Dividends.ex_dividend_date, model.Dividends.cash_amount)
+        .filter(
+            model.Dividends.symbol == asset.symbol,
+            model.Dividends.ex_dividend_date.between(start, end),
+        )
+        .order_by(model.Dividends.ex_dividend_date)
+        .all()
+    )
+    if len(dividends) < 2:
+        return pd.DataFrame()
+    ex_dividend_dates, cash_amounts = (np.array(c) for c in zip(*dividends))
+
+    trading_days = sd.create_trading_days()
+    buy, sell = sim.holding_windows(trading_days, ex_dividend_dates, days_held)
+    first_buy, last_sell = buy.min(0).tolist(), sell[0].tolist()
+    if fill:
+        span = plan_window_download(
+            session, asset.symbol, list(zip(first_buy, last_sell))
         )
+        if span is not None:
+            fd.fill_stock_data(session, asset.symbol, *span)
+    bars = bar_cache(session).get(session, asset.symbol)
+    table = sim.evaluate_grid(
+        bars,
+        trading_days,
+        ex_dividend_dates,
+        cash_amounts,
+        multipliers,
+        stop_losses,
+        days_held,
+    )
+    table.insert(0, "symbol", asset.symbol)
+    table["percentage_downloaded"] = asset.percentage_downloaded
+    table["avg_dividend"] = sd.convert_to_currency(
+        pd.Series(cash_amounts).mode().iloc[0]
     )
+    return table
+
+
+def best_parameters(table: pd.DataFrame):
+    """The row of a grid_search table with the highest portion_to_risk."""
+    if table.empty or table["portion_to_risk"].isna().all():
+        return None
+    return table.loc[table["portion_to_risk"].idxmax()]
 
 
-# @retry((DataLoadError,), max_retries=3, backoff=FixedBackOff(2))
-def get_risk_diffs(session, asset):
-    last_risk_to_reward = risk_numbers(session, asset)
-    risk_diff = []
-    for i in range(len(last_risk_to_reward) - 1):
-        diff = (
-            last_risk_to_reward[i].portion_to_risk
-            - last_risk_to_reward[i + 1].portion_to_risk
+def find_on_grid(symbol, start, end):
+    """Store the best combination of an exhaustive grid_search."""
+    with fd.open_session() as session:
+        asset = (
+            session.query(model.Assets).filter(model.Assets.symbol == symbol).first()
         )
-        # change the diff to the only 3 decimal places
-        formatted_diff = round(diff, 3)
-        risk_diff.append(formatted_diff)
-    return risk_diff
+        best = best_parameters(grid_search(session, asset, start, end))
+        if best is None:
+            logging.warning(f"Could not calculate risk reward for {symbol}")
+            return None
+        session.add(
+            model.RiskReward(
+                symbol=symbol,
+                win_rate=float(best["win_rate"]),
+                avg_gain=float(best["avg_gain"]),
+                loss_rate=float(best["loss_rate"]),
+                avg_loss=float(best["avg_loss"]),
+                percentage_downloaded=best["percentage_downloaded"],
+                avg_dividend=float(best["avg_dividend"]),
+                portion_to_risk=float(best["portion_to_risk"]),
+                last_update=datetime.datetime.now(),
+                div_multiplier=float(best["div_multiplier"]),
+                stop_loss_percentage=float(best["stop_loss_percentage"]),
+            )
+        )
+        session.commit()
+        return best
 
 
-def find(symbol, start, end):
-    searcher = DividendMultiplierSearch(start, end)
+def find(symbol, start, end, strategy="heuristic"):
+    searcher = DividendMultiplierSearch(start, end, strategy)
     searcher.find(symbol)
 
 
-def main():
+# seconds a worker may spend on one symbol before giving up on it, 0 for no limit
+SYMBOL_TIMEOUT = int(os.getenv("BEST_PARAM_SYMBOL_TIMEOUT", 1800))
+# symbols whose rows are written (and checkpointed) per transaction
+WRITE_BATCH = 50
+
+_worker_searcher = None
+_worker_timeout = 0
+
+
+class SymbolTimeout(BaseException):
+    """Not an Exception: the alarm fires once, so the broad except blocks on
+    the download path must not swallow it."""
+
+
+def _on_alarm(signum, frame):
+    raise SymbolTimeout()
+
+
+def init_worker(start, end, strategy="heuristic", timeout=SYMBOL_TIMEOUT):
+    """Pool initializer: the engine, calendars and searcher a worker reuses
+    for every symbol it is handed."""
+    global _worker_searcher, _worker_timeout
+    get_engine()
+    sd.create_calendar()
+    sd.create_trading_days()
+    _worker_searcher = DividendMultiplierSearch(start, end, strategy)
+    _worker_timeout = timeout if hasattr(signal, "SIGALRM") else 0
+    if _worker_timeout:
+        signal.signal(signal.SIGALRM, _on_alarm)
+
+
+def risk_reward_row(entry: model.RiskReward) -> dict:
+    return {
+        column.name: getattr(entry, column.name)
+        for column in model.RiskReward.__table__.columns
+        if column.name != "id"
+    }
+
+
+def search_symbol(symbol):
+    """Worker task, (symbol, rows to insert) or (symbol, None) when it failed."""
+    if _worker_timeout:
+        signal.alarm(_worker_timeout)
+    try:
+        with fd.open_session() as session:
+            asset = (
+                session.query(model.Assets)
+                .filter(model.Assets.symbol == symbol)
+                .first()
+            )
+            entries = _worker_searcher.search(session, asset)
+            return symbol, [risk_reward_row(entry) for entry in entries]
+    except SymbolTimeout:
+        logging.warning("%s timed out after %s seconds", symbol, _worker_timeout)
+    except Exception as e:
+        logging.error("Searching %s failed: %r", symbol, e)
+    finally:
+        if _worker_timeout:
+            signal.alarm(0)
+    return symbol, None
+
+
+def estimated_costs(session, symbols) -> dict[str, int]:
+    """Number of events per symbol, each one is a trade every backtest simulates."""
+    symbols = sorted(symbols)
+    costs = {}
+    for i in range(0, len(symbols), SYMBOLS_PER_QUERY):
+        costs.update(
+            session.execute(
+                select(model.Event.symbol, func.count())
+                .where(model.Event.symbol.in_(symbols[i : i + SYMBOLS_PER_QUERY]))
+                .group_by(model.Event.symbol)
+            ).all()
+        )
+    return costs
+
+
+def schedule(
+    symbols,
+    start,
+    end,
+    strategy="heuristic",
+    processes=None,
+    timeout=SYMBOL_TIMEOUT,
+    checkpoint=None,
+    batch_size=WRITE_BATCH,
+) -> int:
+    """Search symbols on a pool of processes and write the rows from this one.
+
+    Symbols go out one at a time, most events first, so an idle worker always
+    takes the next one and the slowest symbols do not start last. A symbol
+    that fails or runs past timeout is not checkpointed and is retried when
+    the job is run again. Returns the number of symbols written.
+    """
+    symbols = set(symbols)
+    if checkpoint is not None:
+        symbols -= checkpoint.done
+    with fd.open_session() as session:
+        costs = estimated_costs(session, symbols)
+    ordered = sorted(symbols, key=lambda symbol: (-costs.get(symbol, 0), symbol))
+    processes = processes or os.cpu_count() or 1
+    logging.info("Searching %s symbols on %s processes", len(ordered), processes)
+
+    written = 0
+    rows, searched = [], []
+    with fd.open_session() as session:
+
+        def flush():
+            nonlocal written
+            if rows:
+                session.execute(insert(model.RiskReward), rows)
+            session.commit()
+            if checkpoint is not None and searched:
+                checkpoint.mark(searched)
+            written += len(searched)
+            rows.clear()
+            searched.clear()
+
+        with multiprocessing.Pool(
+            processes,
+            initializer=init_worker,
+            initargs=(start, end, strategy, timeout),
+        ) as pool:
+            for symbol, found in pool.imap_unordered(
+                search_symbol, ordered, chunksize=1
+            ):
+                if found is None:
+                    continue
+                rows.extend(found)
+                searched.append(symbol)
+                if len(searched) >= batch_size:
+                    flush()
+                    logging.info("Searched %s of %s symbols", written, len(ordered))
+        flush()
+    return written
+
+
+def main(strategy="heuristic"):
     end = datetime.date.today()
     start = datetime.date(end.year - 10, end.month, end.day)
-    # searcher = DividendMultiplierSearch(start, end)
     with fd.open_session() as session:
         symbols = {stock.symbol for stock in rr.dividend_stocks(session)}
         existing_evaluations = {
             symbol[0] for symbol in session.query(model.RiskReward.symbol).all()
         }
-    with multiprocessing.Pool(7) as pool:
-        symbols_left = [(s, start, end) for s in sorted(symbols - existing_evaluations)]
-        pool.starmap(find, symbols_left)
+    schedule(
+        symbols - existing_evaluations,
+        start,
+        end,
+        strategy,
+        checkpoint=checkpoint_for("best_params", start, end),
+    )
 
 
 if __name__ == "__main__":
@@ -66,7 +66,7 @@ def fix_bad_percentage(dbsession, start_date, end_date):
         asset.min_num_events = 0
         asset.percentage_downloaded = 0.0
         asset.dividend = False
-    fd.fill_dividend_data(dbsession, start_date, end_date, target_assets)
+    fd.fill_dividend_data(dbsession, start_date, end_date, target_assets, force=True)
     dbsession.commit()
 
 
@@ -75,7 +75,7 @@ def fix_negative_min_events(dbsession, start_date, end_date):
     dbsession.query(Dividends).filter(
         Dividends.symbol.in_([asset.symbol for asset in target_assets])
     ).delete()
-    fd.fill_dividend_data(dbsession, start_date, end_date, target_assets)
+    fd.fill_dividend_data(dbsession, start_date, end_date, target_assets, force=True)
     dbsession.commit()
 
 
@@ -0,0 +1,86 @@
+import contextlib
+import os
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.orm import sessionmaker
+
+from stock_data.models import Base
+
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+POOL_RECYCLE_SECONDS = int(os.getenv("DB_POOL_RECYCLE_SECONDS", 1800))
+# symbols per IN list or compound select, below every backend's bound
+# parameter limit and SQLite's 500 terms per compound select
+SYMBOLS_PER_QUERY = 500
+
+_engine = None
+_session_factory = None
+# urls whose schema has been created; inherited by forked workers on purpose
+_schema_ready = set()
+
+
+def database_url() -> str:
+    """DATABASE_URL when set (e.g. sqlite:///stock_data.db), else the local postgres."""
+    url = os.getenv("DATABASE_URL")
+    if url:
+        return url
+    password = os.getenv("DB_PASSWORD")
+    host = os.getenv("DB_HOST", "localhost")
+    return f"postgresql://postgres:{password}@{host}:5432/stock_data"
+
+
+def create_schema(engine: Engine):
+    key = engine.url.render_as_string(hide_password=False)
+    if key not in _schema_ready:
+        Base.metadata.create_all(engine)
+        _schema_ready.add(key)
+
+
+def get_engine() -> Engine:
+    """The engine of this process, created (with the schema) on first use."""
+    global _engine, _session_factory
+    if _engine is None:
+        url = make_url(database_url())
+        options = {"pool_pre_ping": True}
+        if url.get_backend_name() != "sqlite":
+            options.update(
+                pool_size=POOL_SIZE,
+                max_overflow=MAX_OVERFLOW,
+                pool_recycle=POOL_RECYCLE_SECONDS,
+            )
+        _engine = create_engine(url, **options)
+        _session_factory = sessionmaker(bind=_engine, expire_on_commit=False)
+        create_schema(_engine)
+    return _engine
+
+
+def session_factory() -> sessionmaker:
+    get_engine()
+    return _session_factory
+
+
+def dispose_engine(close: bool = True):
+    """Forget this process's engine. close=False leaves pooled connections open
+    for whoever else owns them, which is what a forked child must do."""
+    global _engine, _session_factory
+    if _engine is not None:
+        _engine.dispose(close=close)
+    _engine = None
+    _session_factory = None
+
+
+if hasattr(os, "register_at_fork"):
+    # a child must never reuse the parent's sockets, it builds its own pool
+    os.register_at_fork(after_in_child=lambda: dispose_engine(close=False))
+
+
+@contextlib.contextmanager
+def open_session():
+    dbsession = None
+    try:
+        dbsession = session_factory()()
+        yield dbsession
+    finally:
+        if dbsession:
+            dbsession.close()
@@ -0,0 +1,129 @@
+import collections
+import datetime
+import logging
+
+from sqlalchemy import String, and_, literal, select, true, union_all
+
+from stock_data.database import SYMBOLS_PER_QUERY
+from stock_data.models import Assets, MarketDays, Stock
+
+# present bars a merged interval may re-download to save a separate request
+DEFAULT_MAX_GAP = 5
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+def missing_bar_days(
+    dbsession, symbols, start: datetime.date, end: datetime.date
+) -> dict[str, list[datetime.date]]:
+    """Market days in [start, end] without a stored bar, per symbol.
+
+    Every chunk of symbols is cross joined with market_days and anti joined
+    with stocks, so the database only sends back what is actually missing.
+    """
+    missing = collections.defaultdict(list)
+    for chunk in _chunks(sorted(set(symbols)), SYMBOLS_PER_QUERY):
+        wanted = union_all(
+            *(select(literal(symbol, String).label("symbol")) for symbol in chunk)
+        ).subquery("wanted")
+        query = (
+            select(wanted.c.symbol, MarketDays.date)
+            .select_from(wanted)
+            .join(MarketDays, true())
+            .outerjoin(
+                Stock,
+                and_(Stock.symbol == wanted.c.symbol, Stock.date == MarketDays.date),
+            )
+            .where(MarketDays.date.between(start, end), Stock.id.is_(None))
+            .order_by(wanted.c.symbol, MarketDays.date)
+        )
+        for symbol, date in dbsession.execute(query):
+            missing[symbol].append(date)
+    return missing
+
+
+def coalesce_days(days, position: dict, max_gap: int = 0):
+    """Merge sorted market days into (start, end) intervals.
+
+    Days are contiguous when they are neighbours in the market calendar, and
+    runs separated by at most max_gap market days are merged as well.
+    """
+    intervals = []
+    for day in days:
+        if intervals and position[day] - position[intervals[-1][1]] <= max_gap + 1:
+            intervals[-1][1] = day
+        else:
+            intervals.append([day, day])
+    return [tuple(interval) for interval in intervals]
+
+
+def plan_missing_bars(
+    dbsession,
+    symbols,
+    start: datetime.date,
+    end: datetime.date,
+    max_gap: int = DEFAULT_MAX_GAP,
+) -> dict[str, list[tuple[datetime.date, datetime.date]]]:
+    """Minimal (start, end) daily bar intervals to download for each symbol.
+
+    Days before an asset's start_date are never planned, and symbols that
+    are complete are left out, so a rerun over stored data plans nothing.
+    """
+    symbols = sorted(set(symbols))
+    market_days = [
+        d[0]
+        for d in dbsession.query(MarketDays.date)
+        .filter(MarketDays.date.between(start, end))
+        .order_by(MarketDays.date)
+        .all()
+    ]
+    if not market_days:
+        logging.warning(
+            "No market days stored between %s and %s, planning the whole range",
+            start,
+            end,
+        )
+        return {symbol: [(start, end)] for symbol in symbols}
+    position = {day: i for i, day in enumerate(market_days)}
+
+    listed = {}
+    for chunk in _chunks(symbols, SYMBOLS_PER_QUERY):
+        listed.update(
+            dbsession.query(Assets.symbol, Assets.start_date)
+            .filter(Assets.symbol.in_(chunk), Assets.start_date.is_not(None))
+            .all()
+        )
+
+    plan = {}
+    for symbol, days in missing_bar_days(dbsession, symbols, start, end).items():
+        if symbol in listed:
+            days = [day for day in days if day >= listed[symbol]]
+        if days:
+            plan[symbol] = coalesce_days(days, position, max_gap)
+    return plan
+
+
+def plan_window_download(
+    dbsession, symbol: str, windows
+) -> tuple[datetime.date, datetime.date] | None:
+    """One (start, end) range covering every missing bar inside windows.
+
+    Days between the windows are not looked at, but the range spans them,
+    so a symbol's windows cost a single download. None when nothing is missing.
+    """
+    windows = sorted(windows)
+    span_start = windows[0][0]
+    span_end = max(window_end for _window_start, window_end in windows)
+    missing = plan_missing_bars(dbsession, [symbol], span_start, span_end, 0)
+    covered = [
+        (max(start, window_start), min(end, window_end))
+        for start, end in missing.get(symbol, [])
+        for window_start, window_end in windows
+        if start <= window_end and window_start <= end
+    ]
+    if not covered:
+        return None
+    return min(start for start, _end in covered), max(end for _start, end in covered)
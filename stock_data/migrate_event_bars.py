@@ -0,0 +1,34 @@
+import logging
+
+from sqlalchemy import delete, text
+from sqlalchemy.orm import Session
+
+from stock_data.database import open_session
+from stock_data.models import Stock, event_stocks_association
+
+
+def drop_event_stock_links(session: Session) -> int:
+    """Event.bars resolves bars by date range, the association rows are dead weight."""
+    deleted = session.execute(delete(event_stocks_association)).rowcount
+    session.commit()
+    return deleted
+
+
+def rebuild_covering_index(session: Session):
+    """Recreate stock_symbol_date_index with its INCLUDE columns on postgres.
+
+    create_all never alters an index that already exists, so databases
+    created before the index became covering still have the plain one.
+    """
+    if session.bind.dialect.name != "postgresql":
+        return
+    index = Stock.symbol_date_index
+    session.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+    index.create(session.connection())
+    session.commit()
+
+
+if __name__ == "__main__":
+    with open_session() as session:
+        logging.info("Dropped %s event_stocks rows", drop_event_stock_links(session))
+        rebuild_covering_index(session)
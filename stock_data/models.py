@@ -1,6 +1,15 @@
 import datetime
 
-from sqlalchemy import String, REAL, Date, Boolean, UniqueConstraint, Index, DateTime
+from sqlalchemy import (
+    String,
+    REAL,
+    Date,
+    Boolean,
+    UniqueConstraint,
+    Index,
+    DateTime,
+    Time,
+)
 from sqlalchemy.orm import DeclarativeBase
 from sqlalchemy.orm import Mapped
 from sqlalchemy.orm import mapped_column
@@ -38,7 +47,13 @@ class Stock(Base):
     )
 
     symbol_index = Index("stock_symbol_index", symbol)
-    symbol_date_index = Index("stock_symbol_date_index", symbol, date)
+    # covering on postgres so event ranges are answered from the index alone
+    symbol_date_index = Index(
+        "stock_symbol_date_index",
+        symbol,
+        date,
+        postgresql_include=["open", "high", "low", "close", "volume"],
+    )
 
     __table_args__ = (UniqueConstraint("symbol", "date", name="uix_symbol_date"),)
 
@@ -113,6 +128,14 @@ class Event(Base):
     stock_bars = relationship(
         "Stock", secondary=event_stocks_association, back_populates="events"
     )
+    # resolved from the event's range instead of the event_stocks rows
+    bars = relationship(
+        "Stock",
+        primaryjoin="and_(foreign(Stock.symbol) == Event.symbol, "
+        "Stock.date >= Event.start_date, Stock.date <= Event.end_date)",
+        order_by="Stock.date",
+        viewonly=True,
+    )
 
 
 class MarketDays(Base):
@@ -133,6 +156,16 @@ class Holidays(Base):
     __table_args__ = (UniqueConstraint("date", name="uix_holidays_date"),)
 
 
+class EarlyCloses(Base):
+    """Market days the exchange closes before the regular 16:00."""
+
+    __tablename__ = "early_closes"
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    date: Mapped[datetime.date] = mapped_column(Date)
+    close_time: Mapped[datetime.time] = mapped_column(Time)
+    __table_args__ = (UniqueConstraint("date", name="uix_early_closes_date"),)
+
+
 class RiskReward(Base):
     __tablename__ = "risk_reward"
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
@@ -149,3 +182,19 @@ class RiskReward(Base):
     portion_to_risk: Mapped[float] = mapped_column(REAL, nullable=True)
 
     symbol_index = Index("risk_reward_symbol", symbol)
+
+
+class SyncState(Base):
+    """How far a dataset has been synced, per symbol (or one row per market)."""
+
+    __tablename__ = "sync_state"
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    dataset: Mapped[str] = mapped_column(String)
+    symbol: Mapped[str] = mapped_column(String)
+    last_synced_date: Mapped[datetime.date] = mapped_column(Date, nullable=True)
+    last_checked_at: Mapped[datetime.datetime] = mapped_column(DateTime, nullable=True)
+    cursor: Mapped[str] = mapped_column(String, nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint("dataset", "symbol", name="uix_sync_state_dataset_symbol"),
+    )
@@ -0,0 +1,235 @@
+import datetime
+import logging
+import os
+import queue
+import threading
+import time
+
+from alpaca.data.timeframe import TimeFrame
+from alpaca.trading import GetAssetsRequest, TradingClient
+from sqlalchemy import not_
+
+import stock_data.fill_data as fd
+from stock_data.database import open_session
+from stock_data.models import Assets
+from stock_data.polygon_client import fetch_dividend_announcements
+from stock_data.stock_downloads import download_many_stock_data
+
+CHECKPOINT_DIR = os.getenv("STOCK_DATA_CHECKPOINT_DIR", ".")
+
+_worker_done = object()
+
+
+class Checkpoint:
+    """Append-only file of the symbols a job has already written."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done = set()
+        if os.path.exists(path):
+            with open(path) as f:
+                self.done = {line.strip() for line in f if line.strip()}
+
+    def mark(self, symbols):
+        with open(self.path, "a") as f:
+            f.writelines(f"{symbol}\n" for symbol in symbols)
+            f.flush()
+            os.fsync(f.fileno())
+        self.done.update(symbols)
+
+
+def run_pipeline(
+    symbols,
+    fetch,
+    write,
+    checkpoint: Checkpoint = None,
+    workers: int = 8,
+    fetch_size: int = 1,
+    batch_size: int = 200,
+    max_pending: int = 32,
+    flush_seconds: float = 5.0,
+):
+    """Fetch symbols on a pool of threads and write them from this thread.
+
+    fetch(symbols) gets up to fetch_size symbols and returns {symbol: result}.
+    write(dbsession, results) receives up to batch_size symbols' results and
+    runs in one transaction. At most max_pending fetches wait for the writer,
+    which holds the fetchers back when the database is the bottleneck.
+    Symbols are checkpointed after their batch is committed, so a restarted
+    job skips them; a failed fetch is not checkpointed and is retried then.
+    fetch reports a failure by raising. When write raises, the fetchers are
+    stopped before the error propagates.
+    Returns the number of symbols written.
+    """
+    symbols = sorted(set(symbols))
+    if checkpoint is not None:
+        symbols = [symbol for symbol in symbols if symbol not in checkpoint.done]
+    logging.info("Pipeline has %s symbols to process", len(symbols))
+
+    work = queue.Queue()
+    for i in range(0, len(symbols), fetch_size):
+        work.put(symbols[i : i + fetch_size])
+    results = queue.Queue(maxsize=max_pending)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                results.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                pass
+
+    def fetcher():
+        while not stop.is_set():
+            try:
+                group = work.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                fetched = fetch(group)
+            except Exception as e:
+                logging.error("Fetching %s failed: %r", group, e)
+                continue
+            put((group, fetched))
+        put(_worker_done)
+
+    threads = [
+        threading.Thread(target=fetcher, name=f"fetcher-{i}", daemon=True)
+        for i in range(max(1, min(workers, work.qsize())))
+    ]
+    for thread in threads:
+        thread.start()
+
+    written = 0
+    running = len(threads)
+    pending_symbols, pending_results = [], {}
+    last_flush = time.monotonic()
+    try:
+        with open_session() as dbsession:
+
+            def flush():
+                nonlocal written, last_flush
+                if pending_symbols:
+                    write(dbsession, dict(pending_results))
+                    dbsession.commit()
+                    if checkpoint is not None:
+                        checkpoint.mark(pending_symbols)
+                    written += len(pending_symbols)
+                    logging.info(
+                        "Pipeline wrote %s of %s symbols", written, len(symbols)
+                    )
+                pending_symbols.clear()
+                pending_results.clear()
+                last_flush = time.monotonic()
+
+            while running:
+                try:
+                    item = results.get(timeout=flush_seconds)
+                except queue.Empty:
+                    flush()
+                    continue
+                if item is _worker_done:
+                    running -= 1
+                    continue
+                group, fetched = item
+                pending_symbols.extend(group)
+                pending_results.update(fetched)
+                if (
+                    len(pending_symbols) >= batch_size
+                    or time.monotonic() - last_flush >= flush_seconds
+                ):
+                    flush()
+            flush()
+    finally:
+        # a failed write must not leave fetchers blocked on a full queue
+        stop.set()
+        while True:
+            try:
+                results.get_nowait()
+            except queue.Empty:
+                break
+        for thread in threads:
+            thread.join()
+    return written
+
+
+def checkpoint_for(job: str, start: datetime.date, end: datetime.date) -> Checkpoint:
+    return Checkpoint(os.path.join(CHECKPOINT_DIR, f"{job}-{start}-{end}.checkpoint"))
+
+
+def tradable_symbols() -> set[str]:
+    alpaca_client = TradingClient(**fd.alpaca_creds, paper=False)
+    request = GetAssetsRequest(asset_status="active", asset_class="us_equity")
+    return {
+        asset.symbol
+        for asset in alpaca_client.get_all_assets(request)
+        if asset.tradable
+    }
+
+
+def pipeline_fill_stocks(start, end, symbols=None, workers=4):
+    """Pipelined initial_fill_stocks, resumable through its checkpoint file."""
+    if symbols is None:
+        with open_session() as dbsession:
+            symbols = tradable_symbols() - fd.find_existing_stocks(dbsession)
+
+    def fetch(group):
+        return download_many_stock_data(group, start, end, TimeFrame.Day)
+
+    def write(dbsession, results):
+        fd.upsert_stocks(dbsession, (bar for bars in results.values() for bar in bars))
+
+    return run_pipeline(
+        symbols,
+        fetch,
+        write,
+        checkpoint_for("stocks", start, end),
+        workers=workers,
+        fetch_size=fd.DOWNLOAD_GROUP_SIZE,
+        max_pending=workers * 2,
+    )
+
+
+def pipeline_fill_dividends(start, end, symbols=None, workers=8):
+    """Pipelined fill_dividend_data for assets that have not been checked."""
+    with open_session() as dbsession:
+        query = dbsession.query(Assets.symbol)
+        if symbols is None:
+            query = query.filter(not_(Assets.dividend_checked))
+        else:
+            query = query.filter(Assets.symbol.in_(symbols))
+        symbols = {row[0] for row in query.all()}
+
+    def fetch(group):
+        return {symbol: fetch_dividend_announcements(symbol, start) for symbol in group}
+
+    def write(dbsession, results):
+        now = datetime.datetime.now()
+        assets = dbsession.query(Assets).filter(Assets.symbol.in_(results)).all()
+        states = fd.dividend_sync_states(dbsession, results)
+        fd.store_many_dividend_announcements(dbsession, assets, results, end)
+        for asset in assets:
+            fd.advance_dividend_watermark(
+                dbsession, states[asset.symbol], results[asset.symbol], end, now
+            )
+
+    return run_pipeline(
+        symbols,
+        fetch,
+        write,
+        checkpoint_for("dividends", start, end),
+        workers=workers,
+        batch_size=50,
+    )
+
+
+def main():
+    end = datetime.date.today()
+    start = datetime.date(end.year - 10, 1, 1)
+    pipeline_fill_dividends(start, end)
+    pipeline_fill_stocks(start, end)
+
+
+if __name__ == "__main__":
+    main()
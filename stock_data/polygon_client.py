@@ -1,64 +1,349 @@
+import asyncio
+import email.utils
 import os
+import queue
+import random
+import threading
 
+import httpx
 import requests
 import time
 import logging
 import datetime
 
+from stock_data.response_cache import MISSING, response_cache
+
 api_key = os.environ.get("API_KEY")
 
 logging.basicConfig(level=logging.INFO)
+# httpx logs every request at INFO, far too chatty for thousands of symbols
+logging.getLogger("httpx").setLevel(logging.WARNING)
 
+POLYGON_URL = "https://api.polygon.io"
 
-def get_dividend_announcements(symbol: str, the_day: datetime.date):
-    uri_template = "https://api.polygon.io/v3/reference/dividends?ticker={symbol}&ex_dividend_date.gte={date}&limit=1000&order=asc&sort=ex_dividend_date&apiKey={apikey}"
+# how many requests may be in flight at once against Polygon
+MAX_CONCURRENT_REQUESTS = int(os.environ.get("POLYGON_MAX_CONCURRENCY", 8))
+MAX_RETRIES = 8
+MAX_BACKOFF_SECONDS = 60.0
 
-    repeat = True
-    size = 0
-    date = (the_day + datetime.timedelta(days=2)).strftime("%Y-%m-%d")
-    uri = uri_template.format(apikey=api_key, date=date, symbol=symbol)
-    while repeat:
+_session = None
+
+
+def polygon_session() -> requests.Session:
+    global _session
+    if _session is None:
+        _session = requests.Session()
+    return _session
+
+
+def retry_delay(headers, attempt: int) -> float:
+    """Seconds to wait before retrying, Retry-After wins over exponential backoff."""
+    retry_after = headers.get("Retry-After")
+    if retry_after:
         try:
-            r = requests.get(uri, timeout=(3, 10))
-            r.raise_for_status()
-            r = r.json()
-            if "next_url" in r:
-                uri = r["next_url"] + "&apiKey=" + api_key
-                repeat = True
-            else:
-                repeat = False
-            if "results" in r:
-                size += len(r["results"])
-                if r["results"]:
-                    for asset in r["results"]:
-                        if "currency" in asset and asset["currency"] == "USD":
-                            yield asset
-                        elif "currency" not in asset:
-                            yield asset
-                    logging.info(
-                        f"size: {size}, ex_dividend_date: {r['results'][-1]['ex_dividend_date']}"
-                    )
-
-        except requests.exceptions.HTTPError as err:
-            if r.status_code != 429:
-                logging.error(err)
-                raise err
-            logging.info(err)
-            time.sleep(60)
-            repeat = True
-        except Exception as e:
-            logging.error(repr(e))
-            repeat = False
+            return min(float(retry_after), MAX_BACKOFF_SECONDS)
+        except ValueError:
+            pass
+        try:
+            retry_at = email.utils.parsedate_to_datetime(retry_after)
+        except (TypeError, ValueError):
+            # neither seconds nor an HTTP date, fall back to backoff
+            retry_at = None
+        if retry_at is not None:
+            wait = retry_at.timestamp() - time.time()
+            return min(max(wait, 0.0), MAX_BACKOFF_SECONDS)
+    return min(2**attempt + random.random(), MAX_BACKOFF_SECONDS)
 
 
-def ticker_info(symbol):
-    uri_template = (
-        "https://api.polygon.io/v3/reference/tickers/{symbol}?apiKey={apikey}"
-    )
-    uri = uri_template.format(symbol=symbol, apikey=api_key)
-    r = requests.get(uri, timeout=(3, 10))
+def should_retry(status_code: int) -> bool:
+    return status_code == 429 or status_code >= 500
+
+
+def _get_json(uri: str, params: dict = None) -> dict:
+    for attempt in range(MAX_RETRIES):
+        r = polygon_session().get(uri, params=params, timeout=(3, 10))
+        if not should_retry(r.status_code) or attempt == MAX_RETRIES - 1:
+            break
+        delay = retry_delay(r.headers, attempt)
+        logging.info("Polygon returned %s, retrying in %.1fs", r.status_code, delay)
+        time.sleep(delay)
     r.raise_for_status()
-    json = r.json()
-    if "results" in json:
-        return json["results"]
-    return json
+    return r.json()
+
+
+def dividend_query_params(symbol: str, the_day: datetime.date) -> dict:
+    return {
+        "ticker": symbol,
+        "ex_dividend_date.gte": (the_day + datetime.timedelta(days=2)).strftime(
+            "%Y-%m-%d"
+        ),
+        "limit": 1000,
+        "order": "asc",
+        "sort": "ex_dividend_date",
+    }
+
+
+def usd_announcements(results: list[dict]):
+    for asset in results:
+        if "currency" in asset and asset["currency"] == "USD":
+            yield asset
+        elif "currency" not in asset:
+            yield asset
+
+
+def dividends_cache_key(symbol: str, the_day: datetime.date):
+    return ("polygon", "dividends", symbol, str(the_day))
+
+
+def ticker_cache_key(symbol: str):
+    return ("polygon", "ticker", symbol)
+
+
+def _dividend_pages(symbol: str, the_day: datetime.date):
+    uri = f"{POLYGON_URL}/v3/reference/dividends"
+    params = dict(dividend_query_params(symbol, the_day), apiKey=api_key)
+    while uri:
+        r = _get_json(uri, params)
+        # next_url already carries the query, only the key has to be added
+        uri = r.get("next_url")
+        params = {"apiKey": api_key}
+        if r.get("results"):
+            yield r["results"]
+
+
+def fetch_dividend_announcements(symbol: str, the_day: datetime.date) -> list[dict]:
+    """Every USD announcement of symbol from the_day on. Errors are raised,
+    not logged, so a caller never mistakes a partial download for the whole
+    history."""
+    # open ended towards today, so cached announcements only live for the ttl
+    return response_cache().fetch(
+        dividends_cache_key(symbol, the_day),
+        lambda: [
+            announcement
+            for results in _dividend_pages(symbol, the_day)
+            for announcement in usd_announcements(results)
+        ],
+        recent=True,
+    )
+
+
+def get_dividend_pages_between(start: datetime.date, end: datetime.date):
+    """Every USD announcement with an ex-dividend date in [start, end], all tickers.
+
+    Yields one list per page, in ex-dividend date order, so callers can store
+    a page before the next one is requested.
+    """
+    uri = f"{POLYGON_URL}/v3/reference/dividends"
+    params = {
+        "ex_dividend_date.gte": start.strftime("%Y-%m-%d"),
+        "ex_dividend_date.lte": end.strftime("%Y-%m-%d"),
+        "limit": 1000,
+        "order": "asc",
+        "sort": "ex_dividend_date",
+        "apiKey": api_key,
+    }
+    size = 0
+    while uri:
+        r = _get_json(uri, params)
+        uri = r.get("next_url")
+        params = {"apiKey": api_key}
+        results = r.get("results") or []
+        size += len(results)
+        if results:
+            logging.info(
+                f"size: {size}, ex_dividend_date: {results[-1]['ex_dividend_date']}"
+            )
+        yield list(usd_announcements(results))
+
+
+def ticker_info(symbol):
+    def download():
+        json = _get_json(
+            f"{POLYGON_URL}/v3/reference/tickers/{symbol}", {"apiKey": api_key}
+        )
+        if "results" in json:
+            return json["results"]
+        return json
+
+    return response_cache().fetch(ticker_cache_key(symbol), download)
+
+
+class AsyncPolygonClient:
+    """Polygon client sharing one keep-alive connection pool across many symbols.
+
+    At most max_concurrency requests are in flight. A throttled response
+    pauses every request until its Retry-After (or backoff) has passed, so
+    the whole client slows down together instead of each request hammering
+    the API on its own schedule.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = MAX_CONCURRENT_REQUESTS,
+        max_retries=MAX_RETRIES,
+        transport: httpx.AsyncBaseTransport = None,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.transport = transport
+        self._client = None
+        self._semaphore = None
+        self._resume_at = 0.0
+
+    async def __aenter__(self):
+        self._client = httpx.AsyncClient(
+            base_url=POLYGON_URL,
+            params={"apiKey": api_key},
+            timeout=httpx.Timeout(10.0, connect=3.0),
+            limits=httpx.Limits(
+                max_connections=self.max_concurrency,
+                max_keepalive_connections=self.max_concurrency,
+            ),
+            transport=self.transport,
+        )
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._client.aclose()
+
+    async def _throttle(self, delay: float):
+        loop = asyncio.get_running_loop()
+        self._resume_at = max(self._resume_at, loop.time() + delay)
+
+    async def _wait_for_throttle(self):
+        loop = asyncio.get_running_loop()
+        while (wait := self._resume_at - loop.time()) > 0:
+            await asyncio.sleep(wait)
+
+    async def get_json(self, url: str, params: dict = None) -> dict:
+        for attempt in range(self.max_retries):
+            await self._wait_for_throttle()
+            last_attempt = attempt == self.max_retries - 1
+            try:
+                async with self._semaphore:
+                    response = await self._client.get(url, params=params)
+            except httpx.TransportError as e:
+                if last_attempt:
+                    raise
+                delay = retry_delay({}, attempt)
+                logging.info("Polygon request failed (%r), retrying in %.1fs", e, delay)
+                await self._throttle(delay)
+                continue
+            if not should_retry(response.status_code) or last_attempt:
+                break
+            delay = retry_delay(response.headers, attempt)
+            logging.info(
+                "Polygon returned %s, retrying in %.1fs", response.status_code, delay
+            )
+            await self._throttle(delay)
+        response.raise_for_status()
+        return response.json()
+
+    async def dividend_announcements(
+        self, symbol: str, the_day: datetime.date
+    ) -> list[dict]:
+        key = dividends_cache_key(symbol, the_day)
+        announcements = response_cache().get(key, recent=True)
+        if announcements is not MISSING:
+            return announcements
+        announcements = []
+        url = "/v3/reference/dividends"
+        params = dividend_query_params(symbol, the_day)
+        while url:
+            r = await self.get_json(url, params)
+            url, params = r.get("next_url"), None
+            if r.get("results"):
+                announcements.extend(usd_announcements(r["results"]))
+                logging.debug(
+                    "%s size: %s, ex_dividend_date: %s",
+                    symbol,
+                    len(announcements),
+                    r["results"][-1]["ex_dividend_date"],
+                )
+        response_cache().put(key, announcements)
+        return announcements
+
+    async def ticker_info(self, symbol: str) -> dict:
+        key = ticker_cache_key(symbol)
+        info = response_cache().get(key)
+        if info is not MISSING:
+            return info
+        json = await self.get_json(f"/v3/reference/tickers/{symbol}")
+        info = json["results"] if "results" in json else json
+        response_cache().put(key, info)
+        return info
+
+
+_finished = object()
+
+
+def iter_dividend_announcements(
+    starts: dict[str, datetime.date],
+    max_concurrency: int = MAX_CONCURRENT_REQUESTS,
+    prefetch: int = 64,
+):
+    """Yield (symbol, announcements) for every symbol in starts as each completes.
+
+    The downloads run concurrently on an event loop in a background thread and
+    stay up to prefetch symbols ahead of the consumer, so the caller can write
+    to the database while the next pages are already being fetched. A symbol
+    whose download failed is logged and yielded with None instead of a list,
+    the others carry on.
+    """
+    results = queue.Queue(maxsize=prefetch)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                results.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    async def worker(client, symbols: asyncio.Queue):
+        while not stop.is_set():
+            try:
+                symbol = symbols.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                announcements = await client.dividend_announcements(
+                    symbol, starts[symbol]
+                )
+            except Exception as e:
+                logging.error("Downloading dividends of %s failed: %r", symbol, e)
+                announcements = None
+            await asyncio.to_thread(put, (symbol, announcements))
+
+    async def download():
+        symbols = asyncio.Queue()
+        for symbol in starts:
+            symbols.put_nowait(symbol)
+        async with AsyncPolygonClient(max_concurrency) as client:
+            workers = [
+                worker(client, symbols)
+                for _ in range(min(max_concurrency, len(starts)))
+            ]
+            await asyncio.gather(*workers)
+
+    def run():
+        try:
+            asyncio.run(download())
+        except Exception as e:
+            put(e)
+        finally:
+            put(_finished)
+
+    thread = threading.Thread(target=run, name="polygon-dividends", daemon=True)
+    thread.start()
+    try:
+        while (item := results.get()) is not _finished:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        thread.join()
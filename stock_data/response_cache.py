@@ -0,0 +1,163 @@
+import contextlib
+import datetime
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+import threading
+import time
+import zlib
+
+CACHE_DIR = os.getenv(
+    "STOCK_DATA_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "backtest-data"),
+)
+CACHE_MAX_BYTES = int(os.getenv("STOCK_DATA_CACHE_MAX_MB", 2048)) * 1024 * 1024
+# responses whose range reaches today can still change, they expire after this
+RECENT_TTL_SECONDS = int(os.getenv("STOCK_DATA_CACHE_TTL_SECONDS", 15 * 60))
+CACHE_ENABLED = os.getenv("STOCK_DATA_CACHE", "on").lower() not in ("off", "0", "no")
+
+ENTRY_SUFFIX = ".pickle.z"
+
+MISSING = object()
+
+
+def touches_today(end) -> bool:
+    """True when a request range ending at end may still receive new data."""
+    if end is None:
+        return True
+    if isinstance(end, datetime.datetime):
+        end = end.date()
+    return end >= datetime.date.today()
+
+
+class ResponseCache:
+    """Compressed provider payloads on disk, evicted least recently used first.
+
+    Keys are tuples like (provider, endpoint, symbol, start, end). Historical
+    payloads never expire; recent ones are only served for recent_ttl seconds.
+    A hit refreshes the file's mtime, which is what eviction orders by.
+    """
+
+    def __init__(
+        self,
+        directory: str = CACHE_DIR,
+        max_bytes: int = CACHE_MAX_BYTES,
+        recent_ttl: float = RECENT_TTL_SECONDS,
+        enabled: bool = CACHE_ENABLED,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.recent_ttl = recent_ttl
+        self.enabled = enabled
+        self._size = None
+        # downloads run on thread pools, the size counter is shared by them
+        self._lock = threading.RLock()
+
+    def _path(self, key) -> str:
+        digest = hashlib.sha256(repr(key).encode()).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest + ENTRY_SUFFIX)
+
+    def get(self, key, recent: bool = False):
+        if not self.enabled:
+            return MISSING
+        path = self._path(key)
+        try:
+            age = time.time() - os.stat(path).st_mtime
+            if recent and age > self.recent_ttl:
+                return MISSING
+            with open(path, "rb") as f:
+                payload = pickle.loads(zlib.decompress(f.read()))
+        except FileNotFoundError:
+            return MISSING
+        except (OSError, zlib.error, pickle.UnpicklingError, EOFError) as e:
+            logging.warning("Discarding unreadable cache entry %s: %s", path, e)
+            self._remove(path)
+            return MISSING
+        if not recent:
+            # recent entries keep their write time, it is what their ttl runs from
+            with contextlib.suppress(FileNotFoundError):
+                # another thread may have evicted the entry since it was read
+                os.utime(path)
+        return payload
+
+    def put(self, key, payload):
+        if not self.enabled:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = zlib.compress(pickle.dumps(payload, pickle.HIGHEST_PROTOCOL))
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        with self._lock:
+            previous = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp_path, path)
+            if self._size is not None:
+                self._size += len(data) - previous
+            if self.size() > self.max_bytes:
+                self.evict()
+
+    def fetch(self, key, download, recent: bool = False):
+        """Serve key from disk, calling download() and storing its result on a miss."""
+        payload = self.get(key, recent)
+        if payload is MISSING:
+            payload = download()
+            self.put(key, payload)
+        return payload
+
+    def _entries(self):
+        for root, _dirs, files in os.walk(self.directory):
+            for name in files:
+                # only the cache's own entries, other files may share the directory
+                if not name.endswith(ENTRY_SUFFIX):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield stat.st_mtime, stat.st_size, path
+
+    def size(self) -> int:
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _mtime, size, _path in self._entries())
+            return self._size
+
+    def _remove(self, path):
+        with self._lock:
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+            except FileNotFoundError:
+                return
+            if self._size is not None:
+                self._size -= size
+
+    def evict(self, target: float = 0.9):
+        """Drop least recently used entries until under target * max_bytes."""
+        with self._lock:
+            entries = sorted(self._entries())
+            self._size = sum(size for _mtime, size, _path in entries)
+            for _mtime, _size, path in entries:
+                if self._size <= self.max_bytes * target:
+                    break
+                self._remove(path)
+
+    def clear(self):
+        with self._lock:
+            for _mtime, _size, path in list(self._entries()):
+                self._remove(path)
+            self._size = 0
+
+
+_cache = None
+
+
+def response_cache() -> ResponseCache:
+    global _cache
+    if _cache is None:
+        _cache = ResponseCache()
+    return _cache
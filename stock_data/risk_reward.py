@@ -1,9 +1,12 @@
+import collections
 import datetime
 import logging
+import multiprocessing
 from typing import Any
 
+import numpy as np
 import pandas as pd
-from sqlalchemy import asc, and_
+from sqlalchemy import and_, insert, select, update
 
 import stock_data as sd
 import stock_data.fill_data as fd
@@ -14,6 +17,15 @@ from stock_data.models import (
     Assets,
     Event,
 )
+from stock_data.database import SYMBOLS_PER_QUERY
+from stock_data.gap_planner import plan_window_download
+from stock_data.bar_cache import bar_cache
+from stock_data.simulation import (
+    as_days,
+    load_many_bars,
+    simulate_events,
+    trade_statistics,
+)
 
 
 # what to risk = prob of win/amount of loss - prob of loss/amount of gain
@@ -34,136 +46,204 @@ def dividend_stocks(dbsession) -> list[Any]:
     ]
 
 
-def get_stock(dbsession, symbol, date):
-    calendar = sd.create_calendar()
-    results = (
-        dbsession.query(Stock)
-        .filter(Stock.symbol == symbol, Stock.date == date)
-        .first()
-    )
-    if results is None:
-        logging.info("Filling stock data for %s on %s", symbol, date)
-        fd.fill_stock_data(dbsession, symbol, date, calendar.addbusdays(date, 1))
+class MissingData:
+    """Local data an offline backtest of one symbol had to go without."""
+
+    def __init__(self, symbol: str):
+        self.symbol = symbol
+        # fewer dividends stored than the asset should have
+        self.dividends = False
+        # no regular cash dividend stored, so no frequency to expect events by
+        self.irregular = False
+        # dividends that have no event yet
+        self.events = 0
+        # (start_date, end_date) of event windows without a bar on start_date
+        self.windows = []
+
+    def __bool__(self):
+        return self.dividends or self.irregular or self.events > 0 or bool(self.windows)
+
+    def __repr__(self):
         return (
-            dbsession.query(Stock)
-            .filter(Stock.symbol == symbol, Stock.date == date)
-            .first()
+            f"MissingData({self.symbol!r}, dividends={self.dividends}, "
+            f"irregular={self.irregular}, events={self.events}, "
+            f"windows={len(self.windows)})"
         )
 
+
+def cached_stock(dbsession, symbol, date):
+    """The prices of symbol on date from the bar cache, as an unsaved Stock.
+
+    Only symbol, date and the price and volume columns are set; use
+    get_stock for the stored row.
+    """
+    bars = bar_cache(dbsession).get(dbsession, symbol)
+    i = bars.index_on(date)
+    if i is None:
+        return None
+    return Stock(
+        symbol=symbol,
+        date=bars.dates[i].item(),
+        open=bars.open[i].item(),
+        high=bars.high[i].item(),
+        low=bars.low[i].item(),
+        close=bars.close[i].item(),
+        volume=bars.volume[i].item(),
+    )
+
+
+def cached_or_filled_stock(dbsession, symbol, date, offline=False):
+    """cached_stock, filling the day's bar first when it is missing."""
+    results = cached_stock(dbsession, symbol, date)
+    if results is None and offline:
+        logging.debug("No stock data for %s on %s", symbol, date)
+    elif results is None:
+        logging.info("Filling stock data for %s on %s", symbol, date)
+        next_day = sd.create_trading_days().add_business_days(date, 1)
+        fd.fill_stock_data(dbsession, symbol, date, next_day)
+        return cached_stock(dbsession, symbol, date)
+
     return results
 
 
-def purchase_price(dbsession, symbol, date):
-    stock = get_stock(dbsession, symbol, date)
+def get_stock(dbsession, symbol, date, offline=False):
+    """The stored bar of symbol on date, filled first unless offline."""
+    if cached_or_filled_stock(dbsession, symbol, date, offline) is None:
+        return None
+    return (
+        dbsession.query(Stock)
+        .filter(Stock.symbol == symbol, Stock.date == date)
+        .first()
+    )
+
+
+def purchase_price(dbsession, symbol, date, offline=False):
+    stock = cached_or_filled_stock(dbsession, symbol, date, offline)
     if stock is None:
         return None
     return stock.open
 
 
-def sell_price(dbsession, symbol, date):
-    stock = get_stock(dbsession, symbol, date)
+def sell_price(dbsession, symbol, date, offline=False):
+    stock = cached_or_filled_stock(dbsession, symbol, date, offline)
     if stock is None:
         return None
     return stock.close
 
 
 def simulate_trade(row, dbsession, div_multiplier=1, stop_loss_percentage=0.1):
-    event_days = (
-        dbsession.query(Stock)
-        .filter(
-            and_(
-                Stock.symbol == row["symbol"],
-                Stock.date >= row["start_date"],
-                Stock.date <= row["end_date"],
-            )
-        )
-        .order_by(asc(Stock.date))
-        .all()
-    )
-    if len(event_days) == 0:
-        return 0
-    beginning_price = event_days[0].open
-    end_price = event_days[-1].close
-    if beginning_price is None or end_price is None:
-        return None
-
-    profit_price = sd.convert_to_currency(
-        div_multiplier * row["cash_amount"] + beginning_price
+    bars = bar_cache(dbsession).bars(
+        dbsession, row["symbol"], row["start_date"], row["end_date"]
     )
-    stop_loss = sd.convert_to_currency(beginning_price * (1 - stop_loss_percentage))
-
-    for event in event_days:
-        if event.high >= profit_price:
-            return profit_price - beginning_price
-        elif event.low <= stop_loss:
-            return stop_loss - beginning_price
-
-    return end_price - beginning_price + row["cash_amount"]
+    return simulate_events(
+        bars,
+        [row["start_date"]],
+        [row["end_date"]],
+        [row["cash_amount"]],
+        div_multiplier,
+        stop_loss_percentage,
+    )[0]
 
 
-def process_all_securities(dbsession, assets, buy_days=5):
+def process_all_securities(dbsession, assets, buy_days=5, batch=False, processes=1):
+    """With batch, the assets are backtested with backtest_universe: once on
+    the stored data, then again for the symbols that lacked data after it
+    has been prefetched in bulk."""
     end = datetime.date.today()
     start = datetime.date(end.year - 10, end.month, end.day)
 
-    fd.fill_market_days(start, end)
-    fd.fill_holidays(start, end)
+    fd.sync_market_calendar(dbsession, datetime.date(start.year - 1, 1, 1), end)
 
     existing_evaluations = {
         symbol[0] for symbol in dbsession.query(RiskReward.symbol).all()
     }
     symbols_to_research = set((a.symbol for a in assets)) - existing_evaluations
-    assets_to_research = [a for a in assets if a.symbol in symbols_to_research]
-    for asset in assets_to_research:
-        (
-            _win_rate,
-            loss_rate,
-            avg_gain,
-            avg_loss,
-            percentage_downloaded,
-            avg_dividend,
-            div_multiplier,
-            stop_loss_percentage,
-        ) = backtest_security(dbsession, start, end, asset, buy_days)
-        if _win_rate is not None and (avg_loss > 0 and avg_gain > 0):
-            portion_to_risk = (_win_rate / avg_loss) - (loss_rate / avg_gain)
-            risk_reward_row = RiskReward(
-                symbol=asset.symbol,
-                win_rate=_win_rate,
-                avg_gain=avg_gain,
-                loss_rate=loss_rate,
-                avg_loss=avg_loss,
-                percentage_downloaded=percentage_downloaded,
-                avg_dividend=avg_dividend,
-                portion_to_risk=portion_to_risk,
-                last_update=datetime.datetime.now(),
-                div_multiplier=div_multiplier,
-                stop_loss_percentage=stop_loss_percentage,
+    if batch:
+        _written, reports = backtest_universe(
+            dbsession, end, symbols_to_research, processes=processes
+        )
+        if reports:
+            prefetch_missing_data(dbsession, start, end, reports.values(), buy_days)
+            backtest_universe(
+                dbsession, end, reports, complete_only=False, processes=processes
             )
-            dbsession.add(risk_reward_row)
-            dbsession.commit()
+    else:
+        assets_to_research = [a for a in assets if a.symbol in symbols_to_research]
+        for asset in assets_to_research:
+            (
+                _win_rate,
+                loss_rate,
+                avg_gain,
+                avg_loss,
+                percentage_downloaded,
+                avg_dividend,
+                div_multiplier,
+                stop_loss_percentage,
+            ) = backtest_security(dbsession, start, end, asset, buy_days)
+            if _win_rate is not None and (avg_loss > 0 and avg_gain > 0):
+                portion_to_risk = (_win_rate / avg_loss) - (loss_rate / avg_gain)
+                risk_reward_row = RiskReward(
+                    symbol=asset.symbol,
+                    win_rate=_win_rate,
+                    avg_gain=avg_gain,
+                    loss_rate=loss_rate,
+                    avg_loss=avg_loss,
+                    percentage_downloaded=percentage_downloaded,
+                    avg_dividend=avg_dividend,
+                    portion_to_risk=portion_to_risk,
+                    last_update=datetime.datetime.now(),
+                    div_multiplier=div_multiplier,
+                    stop_loss_percentage=stop_loss_percentage,
+                )
+                dbsession.add(risk_reward_row)
+                dbsession.commit()
     return pd.read_sql(
         dbsession.query(RiskReward).statement, dbsession.bind, index_col="id"
     )
 
 
 def backtest_security(
-    dbsession, start, end, asset, buy_days=5, div_multiplier=1, stop_loss_percentage=0.1
+    dbsession,
+    start,
+    end,
+    asset,
+    buy_days=5,
+    div_multiplier=1,
+    stop_loss_percentage=0.1,
+    offline=False,
+    missing: MissingData = None,
 ):
+    """Offline, nothing is downloaded: what is lacking is recorded in missing
+    and the backtest runs on the data that is stored."""
     null_return = [None] * 8
+    if missing is None:
+        missing = MissingData(asset.symbol)
     num_of_months = fd.num_months_between_dates(asset.start_date, end)
     frequeny = fd.find_frequency(asset)
+    if frequeny == -1 and offline:
+        missing.irregular = True
+        return null_return
     if frequeny == -1:
         asset.dividend = False
         dbsession.add(asset)
         dbsession.commit()
         return null_return
-    asset.min_num_events = fd.calulate_num_event(num_of_months, frequeny)
+    min_num_events = fd.calulate_num_event(num_of_months, frequeny)
+    if not offline:
+        # offline runs stay read-only, an assigned attribute would be autoflushed
+        asset.min_num_events = min_num_events
 
     div_data = [d for d in asset.dividends if d.ex_dividend_date < end]
-    if len(div_data) < asset.min_num_events:
-        fd.fill_dividend_data(dbsession, start, end, [asset])
+    if len(div_data) < min_num_events:
+        if offline:
+            missing.dividends = True
+        else:
+            fd.fill_dividend_data(dbsession, start, end, [asset])
     if len(asset.events) < len(asset.dividends):
-        fd.fill_event_data(dbsession, start, end, buy_days, [asset])
+        if offline:
+            missing.events = len(asset.dividends) - len(asset.events)
+        else:
+            fd.fill_event_data(dbsession, start, end, buy_days, [asset])
     query = (
         dbsession.query(
             Assets.symbol, Dividends.cash_amount, Event.start_date, Event.end_date
@@ -179,13 +259,24 @@ def backtest_security(
     if len(divs) < 2:
         return null_return
 
-    calendar = sd.create_calendar()
-    divs["gain"] = divs[["symbol", "start_date", "end_date", "cash_amount"]].apply(
-        simulate_trade, args=(dbsession, div_multiplier, stop_loss_percentage), axis=1
-    )
-    divs["purchase_price"] = divs["start_date"].map(
-        lambda x: purchase_price(dbsession, asset.symbol, x)
+    bars = bar_cache(dbsession).get(dbsession, asset.symbol)
+    divs["gain"] = simulate_events(
+        bars,
+        divs["start_date"],
+        divs["end_date"],
+        divs["cash_amount"],
+        div_multiplier,
+        stop_loss_percentage,
     )
+    divs["purchase_price"] = bars.open_on(divs["start_date"])
+    no_price = divs["purchase_price"].isna()
+    if offline:
+        windows = divs.loc[no_price, ["start_date", "end_date"]].drop_duplicates()
+        missing.windows.extend(windows.itertuples(index=False, name=None))
+    else:
+        divs.loc[no_price, "purchase_price"] = divs.loc[no_price, "start_date"].map(
+            lambda x: purchase_price(dbsession, asset.symbol, x)
+        )
     divs["percent_gain"] = divs["gain"] / divs["purchase_price"]
     divs["win"] = divs["gain"] > 0
     if len(divs) == 0:
@@ -225,6 +316,282 @@ def backtest_security(
     )
 
 
+def backtest_offline(dbsession, start, end, assets, buy_days=5, **parameters):
+    """backtest_security without any downloads.
+
+    Returns the results of the symbols whose data is complete and the
+    MissingData of the others, for prefetch_missing_data.
+    """
+    results, reports = {}, {}
+    for asset in assets:
+        missing = MissingData(asset.symbol)
+        result = backtest_security(
+            dbsession,
+            start,
+            end,
+            asset,
+            buy_days,
+            offline=True,
+            missing=missing,
+            **parameters,
+        )
+        if missing:
+            reports[asset.symbol] = missing
+        else:
+            results[asset.symbol] = result
+    logging.info(
+        "Backtested %s symbols offline, %s are missing data", len(results), len(reports)
+    )
+    return results, reports
+
+
+def prefetch_missing_data(dbsession, start, end, reports, buy_days=5):
+    """Download what offline backtests reported missing, in bulk.
+
+    Dividends are fetched concurrently for all symbols together, from start
+    whatever their watermark says since the gaps can be older than it. Then
+    events are created, then the bars of every symbol's missing windows are
+    downloaded with one request per symbol (or per group sharing a range).
+    """
+    reports = [report for report in reports if report]
+    if not reports:
+        return 0
+    assets = {
+        asset.symbol: asset
+        for asset in dbsession.query(Assets).filter(
+            Assets.symbol.in_([report.symbol for report in reports])
+        )
+    }
+    need_dividends = [assets[r.symbol] for r in reports if r.dividends or r.irregular]
+    if need_dividends:
+        fd.fill_dividend_data(dbsession, start, end, need_dividends, force=True)
+    need_events = [
+        assets[r.symbol] for r in reports if r.dividends or r.irregular or r.events
+    ]
+    if need_events:
+        fd.fill_event_data(dbsession, start, end, buy_days, need_events)
+
+    symbols_by_span = collections.defaultdict(list)
+    for report in reports:
+        if report.windows:
+            span = plan_window_download(dbsession, report.symbol, report.windows)
+            if span is not None:
+                symbols_by_span[span].append(report.symbol)
+    for (span_start, span_end), symbols in symbols_by_span.items():
+        fd.fill_stock_data(dbsession, symbols, span_start, span_end)
+    return len(reports)
+
+
+# symbols whose inputs are loaded, evaluated and written together
+UNIVERSE_BATCH = 200
+
+
+class SymbolInputs:
+    """Everything backtest_security reads for one symbol, loaded in bulk."""
+
+    def __init__(self, asset_id, symbol, start_date, percentage_downloaded):
+        self.asset_id = asset_id
+        self.symbol = symbol
+        self.start_date = start_date
+        self.percentage_downloaded = percentage_downloaded
+        self.dividends = []
+        self.events = []
+        self.bars = None
+
+    def frequency(self) -> float:
+        """fd.find_frequency over the loaded dividends."""
+        frequency_counter = collections.Counter(
+            frequency
+            for _cash_amount, _ex_dividend_date, frequency, dividend_type in (
+                self.dividends
+            )
+            if frequency != "-1" and dividend_type == "CD"
+        )
+        if len(frequency_counter) == 0:
+            return -1
+        return float(frequency_counter.most_common(1)[0][0])
+
+
+def load_universe(dbsession, symbols) -> dict[str, SymbolInputs]:
+    """Assets, dividends, events and bars of symbols, grouped per symbol.
+
+    Each kind is read with one query per SYMBOLS_PER_QUERY symbols instead
+    of the lazy loads and per-symbol queries of backtest_security.
+    """
+    symbols = sorted(set(symbols))
+    universe = {}
+    for i in range(0, len(symbols), SYMBOLS_PER_QUERY):
+        chunk = symbols[i : i + SYMBOLS_PER_QUERY]
+        for row in dbsession.execute(
+            select(
+                Assets.id,
+                Assets.symbol,
+                Assets.start_date,
+                Assets.percentage_downloaded,
+            ).where(Assets.symbol.in_(chunk))
+        ):
+            universe[row.symbol] = SymbolInputs(*row)
+        for symbol, *dividend in dbsession.execute(
+            select(
+                Dividends.symbol,
+                Dividends.cash_amount,
+                Dividends.ex_dividend_date,
+                Dividends.frequency,
+                Dividends.dividend_type,
+            )
+            .where(Dividends.symbol.in_(chunk))
+            .order_by(Dividends.id)
+        ):
+            universe[symbol].dividends.append(dividend)
+        for symbol, *event in dbsession.execute(
+            select(Assets.symbol, Event.start_date, Event.end_date)
+            .join(Event, Event.asset_id == Assets.id)
+            .where(Assets.symbol.in_(chunk))
+            .order_by(Event.id)
+        ):
+            universe[symbol].events.append(event)
+    for symbol, bars in load_many_bars(dbsession, universe).items():
+        universe[symbol].bars = bars
+    return universe
+
+
+def evaluate_inputs(
+    inputs: SymbolInputs,
+    end,
+    div_multiplier=1,
+    stop_loss_percentage=0.1,
+    complete_only=True,
+):
+    """backtest_security of one symbol's loaded inputs, nothing is read or
+    downloaded. Returns (RiskReward row or None, MissingData); with
+    complete_only a symbol missing data gets no row."""
+    missing = MissingData(inputs.symbol)
+    num_of_months = fd.num_months_between_dates(inputs.start_date, end)
+    min_num_events = fd.calulate_num_event(num_of_months, inputs.frequency())
+    div_data = [d for d in inputs.dividends if d[1] < end]
+    if len(div_data) < min_num_events:
+        missing.dividends = True
+    if len(inputs.events) < len(inputs.dividends):
+        missing.events = len(inputs.dividends) - len(inputs.events)
+    # backtest_security pairs every dividend of a symbol with every event
+    if len(inputs.dividends) * len(inputs.events) < 2:
+        return None, missing
+
+    event_starts = as_days([start_date for start_date, _ in inputs.events])
+    event_ends = as_days([end_date for _, end_date in inputs.events])
+    event_prices = inputs.bars.open_on(event_starts)
+    no_price = np.isnan(event_prices)
+    missing.windows.extend(
+        dict.fromkeys(
+            (start_date, end_date)
+            for (start_date, end_date), unpriced in zip(inputs.events, no_price)
+            if unpriced
+        )
+    )
+    if complete_only and missing:
+        return None, missing
+
+    cash_amounts = np.array([dividend[0] for dividend in inputs.dividends])
+    events = len(inputs.events)
+    gains = simulate_events(
+        inputs.bars,
+        np.tile(event_starts, len(cash_amounts)),
+        np.tile(event_ends, len(cash_amounts)),
+        np.repeat(cash_amounts, events),
+        div_multiplier,
+        stop_loss_percentage,
+    )
+    stats = trade_statistics(gains, np.tile(event_prices, len(cash_amounts)))
+    if not (stats["avg_loss"] > 0 and stats["avg_gain"] > 0):
+        return None, missing
+    return (
+        {
+            "symbol": inputs.symbol,
+            "win_rate": float(stats["win_rate"]),
+            "loss_rate": float(stats["loss_rate"]),
+            "avg_gain": float(stats["avg_gain"]),
+            "avg_loss": float(stats["avg_loss"]),
+            "percentage_downloaded": inputs.percentage_downloaded,
+            "avg_dividend": sd.convert_to_currency(
+                float(pd.Series(cash_amounts).mode().iloc[0])
+            ),
+            "portion_to_risk": float(stats["portion_to_risk"]),
+            "last_update": datetime.datetime.now(),
+            "div_multiplier": div_multiplier,
+            "stop_loss_percentage": stop_loss_percentage,
+        },
+        missing,
+    )
+
+
+def backtest_universe(
+    dbsession,
+    end,
+    symbols,
+    div_multiplier=1,
+    stop_loss_percentage=0.1,
+    complete_only=True,
+    processes=1,
+    batch_size=UNIVERSE_BATCH,
+):
+    """Backtest many symbols from bulk-loaded inputs and bulk-insert the rows.
+
+    Symbols are handled batch_size at a time: their inputs are loaded with
+    load_universe, evaluated (on processes worker processes when more than
+    one) and their RiskReward rows inserted in one statement. Assets without
+    a regular dividend frequency lose their dividend flag, as in
+    backtest_security. Returns the number of rows written and the
+    MissingData of the symbols that lacked data.
+    """
+    symbols = sorted(set(symbols))
+    written, reports = 0, {}
+    pool = multiprocessing.Pool(processes) if processes > 1 else None
+    try:
+        for i in range(0, len(symbols), batch_size):
+            universe = load_universe(dbsession, symbols[i : i + batch_size])
+            tasks, no_frequency = [], []
+            for inputs in universe.values():
+                if inputs.frequency() == -1:
+                    no_frequency.append({"id": inputs.asset_id, "dividend": False})
+                else:
+                    tasks.append(
+                        (
+                            inputs,
+                            end,
+                            div_multiplier,
+                            stop_loss_percentage,
+                            complete_only,
+                        )
+                    )
+            if no_frequency:
+                dbsession.execute(update(Assets), no_frequency)
+            if pool is None:
+                results = [evaluate_inputs(*task) for task in tasks]
+            else:
+                results = pool.starmap(evaluate_inputs, tasks)
+            rows = []
+            for row, missing in results:
+                if missing:
+                    reports[missing.symbol] = missing
+                if row is not None:
+                    rows.append(row)
+            if rows:
+                dbsession.execute(insert(RiskReward), rows)
+            dbsession.commit()
+            written += len(rows)
+            logging.info(
+                "Backtested %s of %s symbols, %s rows written",
+                min(i + batch_size, len(symbols)),
+                len(symbols),
+                written,
+            )
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return written, reports
+
+
 if __name__ == "__main__":
     with fd.open_session() as session:
         process_all_securities(session, dividend_stocks(session))
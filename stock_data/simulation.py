@@ -0,0 +1,314 @@
+import collections
+
+import numpy as np
+import pandas as pd
+
+import stock_data as sd
+from stock_data.bar_store import bar_store
+from stock_data.database import SYMBOLS_PER_QUERY
+from stock_data.models import Stock
+
+currency = np.vectorize(sd.convert_to_currency, otypes=[float])
+
+
+def as_days(dates) -> np.ndarray:
+    return np.asarray(dates, dtype="datetime64[D]")
+
+
+class SymbolBars:
+    """A symbol's daily bars as sorted NumPy arrays, loaded with one query."""
+
+    columns = ("open", "high", "low", "close", "volume")
+
+    def __init__(self, dates, open, high, low, close, volume=None):
+        self.dates = as_days(dates)
+        self.open = np.asarray(open, dtype=float)
+        self.high = np.asarray(high, dtype=float)
+        self.low = np.asarray(low, dtype=float)
+        self.close = np.asarray(close, dtype=float)
+        if volume is None:
+            volume = np.full(len(self.dates), np.nan)
+        self.volume = np.asarray(volume, dtype=float)
+
+    @classmethod
+    def from_db(cls, dbsession, symbol: str, start=None, end=None) -> "SymbolBars":
+        query = dbsession.query(
+            Stock.date, Stock.open, Stock.high, Stock.low, Stock.close, Stock.volume
+        ).filter(Stock.symbol == symbol)
+        if start is not None:
+            query = query.filter(Stock.date >= start)
+        if end is not None:
+            query = query.filter(Stock.date <= end)
+        return cls.from_rows(query.order_by(Stock.date).all())
+
+    @classmethod
+    def from_rows(cls, rows) -> "SymbolBars":
+        """From (date, open, high, low, close, volume) rows sorted by date."""
+        if not rows:
+            return cls([], [], [], [], [], [])
+        dates, *prices = zip(*rows)
+        # a missing price is NaN, which never touches a target
+        return cls(
+            dates,
+            *(
+                [np.nan if value is None else value for value in column]
+                for column in prices
+            ),
+        )
+
+    @classmethod
+    def from_store(cls, store, symbol: str, start=None, end=None) -> "SymbolBars":
+        bars = store.read(symbol, start, end)
+        return cls(bars["date"], *(bars[column] for column in cls.columns))
+
+    def __len__(self):
+        return len(self.dates)
+
+    @property
+    def nbytes(self) -> int:
+        return self.dates.nbytes + sum(
+            getattr(self, column).nbytes for column in self.columns
+        )
+
+    def between(self, start=None, end=None) -> "SymbolBars":
+        """The bars in [start, end], sharing this instance's memory."""
+        first = 0 if start is None else np.searchsorted(self.dates, as_days(start))
+        stop = (
+            len(self)
+            if end is None
+            else np.searchsorted(self.dates, as_days(end), side="right")
+        )
+        window = slice(first, max(first, stop))
+        return SymbolBars(
+            self.dates[window],
+            *(getattr(self, column)[window] for column in self.columns),
+        )
+
+    def index_on(self, date):
+        """Index of the bar on exactly date, or None."""
+        day = as_days(date)
+        i = int(np.searchsorted(self.dates, day))
+        if i < len(self) and self.dates[i] == day:
+            return i
+        return None
+
+    def windows(self, starts, ends) -> tuple[np.ndarray, np.ndarray]:
+        """Index ranges [first, stop) of the bars inside each [start, end]."""
+        first = np.searchsorted(self.dates, as_days(starts), side="left")
+        stop = np.searchsorted(self.dates, as_days(ends), side="right")
+        return first, np.maximum(first, stop)
+
+    def open_on(self, dates) -> np.ndarray:
+        """Open of the bar on exactly each date, NaN when there is none."""
+        dates = as_days(dates)
+        index = np.searchsorted(self.dates, dates)
+        found = index < len(self)
+        found[found] = self.dates[index[found]] == dates[found]
+        opens = np.full(dates.shape, np.nan)
+        opens[found] = self.open[index[found]]
+        return opens
+
+
+def load_bars(dbsession, symbol: str, start=None, end=None) -> SymbolBars:
+    """From the bar store when it is enabled and has the symbol, else the database."""
+    store = bar_store()
+    if store is not None and store.has(symbol):
+        return SymbolBars.from_store(store, symbol, start, end)
+    return SymbolBars.from_db(dbsession, symbol, start, end)
+
+
+def load_many_bars(dbsession, symbols) -> dict[str, SymbolBars]:
+    """load_bars for many symbols, the ones not in the bar store read with one
+    query per SYMBOLS_PER_QUERY symbols."""
+    symbols = sorted(set(symbols))
+    store = bar_store()
+    bars = {}
+    if store is not None:
+        bars = {
+            symbol: SymbolBars.from_store(store, symbol)
+            for symbol in symbols
+            if store.has(symbol)
+        }
+    rest = [symbol for symbol in symbols if symbol not in bars]
+    rows = collections.defaultdict(list)
+    for i in range(0, len(rest), SYMBOLS_PER_QUERY):
+        query = (
+            dbsession.query(
+                Stock.symbol,
+                Stock.date,
+                Stock.open,
+                Stock.high,
+                Stock.low,
+                Stock.close,
+                Stock.volume,
+            )
+            .filter(Stock.symbol.in_(rest[i : i + SYMBOLS_PER_QUERY]))
+            .order_by(Stock.symbol, Stock.date)
+        )
+        for symbol, *bar in query:
+            rows[symbol].append(bar)
+    for symbol in rest:
+        bars[symbol] = SymbolBars.from_rows(rows.get(symbol, []))
+    return bars
+
+
+def simulate_windows(
+    bars: SymbolBars,
+    first,
+    stop,
+    cash_amounts,
+    div_multiplier=1,
+    stop_loss_percentage=0.1,
+) -> np.ndarray:
+    """Gain of buying at the first open of every window and exiting at the
+    first profit target or stop loss touch, else at the last close plus the
+    dividend. A day reaching the target exits there even if it also hits the
+    stop, and an empty window gains 0.
+
+    Windows are the last axis of first and stop, which may carry more axes
+    (e.g. one row of windows per holding period). div_multiplier and
+    stop_loss_percentage may be arrays broadcasting against them, e.g. shape
+    (m, 1, 1) and (s, 1), so a whole parameter grid is simulated at once.
+    """
+    first = np.asarray(first)
+    stop = np.asarray(stop)
+    cash_amounts = np.asarray(cash_amounts, dtype=float)
+    multiplier = np.asarray(div_multiplier, dtype=float)
+    stop_loss_percentage = np.asarray(stop_loss_percentage, dtype=float)
+    empty = first >= stop
+    if not len(bars) or empty.all():
+        shape = np.broadcast_shapes(
+            multiplier.shape,
+            stop_loss_percentage.shape,
+            cash_amounts.shape,
+            first.shape,
+        )
+        return np.zeros(shape)
+
+    begin = np.where(empty, np.nan, bars.open[np.minimum(first, len(bars) - 1)])
+    end_price = np.where(empty, np.nan, bars.close[np.maximum(stop, 1) - 1])
+
+    profit_price = currency(multiplier * cash_amounts + begin)
+    stop_price = currency(begin * (1 - stop_loss_percentage))
+
+    # bars of every window side by side, padded with days that never touch
+    width = int((stop - first).max(initial=0))
+    day = first[..., None] + np.arange(width)
+    in_window = day < stop[..., None]
+    day = np.minimum(day, len(bars) - 1)
+    highs = np.where(in_window, bars.high[day], -np.inf)
+    lows = np.where(in_window, bars.low[day], np.inf)
+
+    profit_touch = highs >= profit_price[..., None]
+    stop_touch = lows <= stop_price[..., None]
+    first_profit = np.where(profit_touch.any(-1), profit_touch.argmax(-1), width)
+    first_stop = np.where(stop_touch.any(-1), stop_touch.argmax(-1), width)
+
+    gains = np.where(
+        first_profit < width,
+        profit_price - begin,
+        end_price - begin + cash_amounts,
+    )
+    gains = np.where(
+        (first_stop < width) & (first_stop < first_profit), stop_price - begin, gains
+    )
+    return np.where(empty, 0.0, gains)
+
+
+def simulate_events(
+    bars: SymbolBars,
+    starts,
+    ends,
+    cash_amounts,
+    div_multiplier=1,
+    stop_loss_percentage=0.1,
+) -> np.ndarray:
+    """simulate_windows for events given by their start and end dates."""
+    first, stop = bars.windows(starts, ends)
+    return simulate_windows(
+        bars, first, stop, cash_amounts, div_multiplier, stop_loss_percentage
+    )
+
+
+def trade_statistics(gains, purchase_prices) -> dict[str, np.ndarray]:
+    """backtest_security's win rate and average gain/loss along the last axis.
+
+    Percent gains are relative to the purchase price; trades without one
+    count towards the rates but not the averages.
+    """
+    gains = np.asarray(gains, dtype=float)
+    percent_gain = gains / purchase_prices
+    known = ~np.isnan(percent_gain)
+    wins = gains > 0
+    losses = gains < 0
+    win_rate = wins.sum(-1) / gains.shape[-1]
+    loss_rate = 1 - win_rate
+    with np.errstate(invalid="ignore", divide="ignore"):
+        avg_gain = np.where(wins & known, percent_gain, 0).sum(-1) / (wins & known).sum(
+            -1
+        )
+        avg_loss = np.where(losses & known, np.abs(percent_gain), 0).sum(-1) / (
+            losses & known
+        ).sum(-1)
+        avg_gain = np.where(win_rate > 0, avg_gain, 0.0)
+        avg_loss = np.where(loss_rate > 0, avg_loss, 0.0)
+        portion_to_risk = np.where(
+            (avg_gain > 0) & (avg_loss > 0),
+            win_rate / avg_loss - loss_rate / avg_gain,
+            np.nan,
+        )
+    return {
+        "win_rate": win_rate,
+        "loss_rate": loss_rate,
+        "avg_gain": avg_gain,
+        "avg_loss": avg_loss,
+        "portion_to_risk": portion_to_risk,
+    }
+
+
+def holding_windows(trading_days, ex_dividend_dates, holding_days):
+    """(buy, sell) dates of every dividend for every holding period.
+
+    Sells the business day before the ex-dividend date and buys holding_days
+    business days before that, like fill_event_data. Shape (h, n).
+    """
+    sell = trading_days.add_business_days(as_days(ex_dividend_dates), -1)
+    holding_days = np.asarray(holding_days)[:, None]
+    buy = trading_days.add_business_days(sell, -holding_days)
+    return buy, np.broadcast_to(sell, buy.shape)
+
+
+def evaluate_grid(
+    bars: SymbolBars,
+    trading_days,
+    ex_dividend_dates,
+    cash_amounts,
+    div_multipliers,
+    stop_loss_percentages,
+    holding_days,
+) -> pd.DataFrame:
+    """Statistics of every div_multiplier x stop_loss_percentage x holding_days
+    combination, simulated in one broadcast pass. One row per combination."""
+    multipliers = np.asarray(div_multipliers, dtype=float)
+    stop_losses = np.asarray(stop_loss_percentages, dtype=float)
+    holding_days = np.asarray(holding_days)
+    buy, sell = holding_windows(trading_days, ex_dividend_dates, holding_days)
+    first, stop = bars.windows(buy, sell)
+    gains = simulate_windows(
+        bars,
+        first,
+        stop,
+        cash_amounts,
+        multipliers[:, None, None, None],
+        stop_losses[:, None, None],
+    )
+    statistics = trade_statistics(gains, bars.open_on(buy))
+    grid = np.meshgrid(multipliers, stop_losses, holding_days, indexing="ij")
+    return pd.DataFrame(
+        {
+            "div_multiplier": grid[0].ravel(),
+            "stop_loss_percentage": grid[1].ravel(),
+            "holding_days": grid[2].ravel(),
+            **{name: values.ravel() for name, values in statistics.items()},
+        }
+    )
@@ -1,6 +1,7 @@
 import datetime
 import os
 
+import pandas as pd
 import yfinance
 from alpaca.data import StockHistoricalDataClient, TimeFrame, StockBarsRequest
 from retry_reloaded import retry
@@ -8,6 +9,7 @@ from urllib3.exceptions import ReadTimeoutError
 from requests.exceptions import ReadTimeout
 
 from stock_data.models import Stock
+from stock_data.response_cache import MISSING, response_cache, touches_today
 import stock_data as sd
 
 alpaca_creds = {
@@ -16,69 +18,268 @@ alpaca_creds = {
 }
 
 
+# Alpaca accepts many symbols per bars request and pages through the combined
+# result with next_page_token, which StockHistoricalDataClient follows for us.
+ALPACA_SYMBOLS_PER_REQUEST = 100
+
+_alpaca_client = None
+
+
+def alpaca_data_client() -> StockHistoricalDataClient:
+    """One long-lived client so every request reuses the same connection pool."""
+    global _alpaca_client
+    if _alpaca_client is None:
+        # make sure the API key is set in the environment
+        _alpaca_client = StockHistoricalDataClient(**alpaca_creds)
+    return _alpaca_client
+
+
+def rows_to_stocks(symbol: str, rows) -> list[Stock]:
+    """Rows are (date, open, high, low, close, volume, trade_count) tuples."""
+    return [
+        Stock(
+            symbol=symbol,
+            date=date,
+            open=open_,
+            high=high,
+            low=low,
+            close=close,
+            volume=volume,
+            trade_count=trade_count,
+            dividend=False,
+        )
+        for date, open_, high, low, close, volume, trade_count in rows
+    ]
+
+
+def cached_rows(
+    provider: str, symbols, start, end, timeframe, download, cache_empty=False
+) -> dict:
+    """Bar rows per symbol, only asking download(symbols) for cache misses.
+
+    Empty answers are only cached with cache_empty, for providers that raise
+    on errors, so a symbol they have no history for is not requested again
+    for the same range. yfinance answers a rate limit or a transient error
+    with an empty frame, which must not stick.
+    """
+    cache = response_cache()
+    recent = touches_today(end)
+
+    def key(symbol):
+        return (provider, "bars", symbol, str(start), str(end), str(timeframe))
+
+    rows = {}
+    misses = []
+    for symbol in symbols:
+        symbol_rows = cache.get(key(symbol), recent)
+        if symbol_rows is MISSING:
+            misses.append(symbol)
+        else:
+            rows[symbol] = symbol_rows
+    if misses:
+        downloaded = download(misses)
+        for symbol in misses:
+            rows[symbol] = downloaded.get(symbol, [])
+            if rows[symbol] or cache_empty:
+                cache.put(key(symbol), rows[symbol])
+    return rows
+
+
+def alpaca_rows(bars) -> list[tuple]:
+    return [
+        (
+            bar.timestamp,
+            bar.open,
+            bar.high,
+            bar.low,
+            bar.close,
+            bar.volume,
+            bar.trade_count,
+        )
+        for bar in bars
+    ]
+
+
 @retry((ReadTimeout,))
+def _pull_chunk_from_alpaca(symbols, start, end, timeframe) -> dict[str, list]:
+    bars_request = StockBarsRequest(
+        symbol_or_symbols=list(symbols), start=start, end=end, timeframe=timeframe
+    )
+    bars = alpaca_data_client().get_stock_bars(bars_request)
+    return {
+        symbol: alpaca_rows(symbol_bars) for symbol, symbol_bars in bars.data.items()
+    }
+
+
 def pull_from_alpaca(
     symbol: str, start: datetime.date, end: datetime.date, timeframe: TimeFrame
 ) -> list[Stock]:
-    client = StockHistoricalDataClient(
-        **alpaca_creds
-    )  # make sure the API key is set in the environment
-    bars_request = StockBarsRequest(
-        symbol_or_symbols=symbol, start=start, end=end, timeframe=timeframe
+    rows = cached_rows(
+        "alpaca",
+        [symbol],
+        start,
+        end,
+        timeframe,
+        lambda symbols: _pull_chunk_from_alpaca(symbols, start, end, timeframe),
+        cache_empty=True,
     )
-    bars = client.get_stock_bars(bars_request)
-    if not bars[symbol]:
+    if not rows[symbol]:
         return None
+    return rows_to_stocks(symbol, rows[symbol])
+
+
+def pull_many_from_alpaca(
+    symbols,
+    start: datetime.date,
+    end: datetime.date,
+    timeframe: TimeFrame,
+    chunk_size: int = ALPACA_SYMBOLS_PER_REQUEST,
+) -> dict[str, list[Stock]]:
+    """Download bars for many symbols, chunk_size symbols per request.
+
+    Symbols without any bars in the range are left out of the result.
+    """
+
+    def download(misses):
+        downloaded = {}
+        for i in range(0, len(misses), chunk_size):
+            downloaded.update(
+                _pull_chunk_from_alpaca(
+                    misses[i : i + chunk_size], start, end, timeframe
+                )
+            )
+        return downloaded
+
+    rows = cached_rows(
+        "alpaca",
+        sorted(set(symbols)),
+        start,
+        end,
+        timeframe,
+        download,
+        cache_empty=True,
+    )
+    return {
+        symbol: rows_to_stocks(symbol, symbol_rows)
+        for symbol, symbol_rows in rows.items()
+        if symbol_rows
+    }
+
+
+YAHOO_SYMBOLS_PER_REQUEST = 100
+
+yahoo_timeframes = {
+    str(TimeFrame.Day): "1d",
+    str(TimeFrame.Minute): "1m",
+    str(TimeFrame.Hour): "1h",
+}
+
+yahoo_columns = ["Open", "High", "Low", "Close", "Volume"]
+
+
+def yahoo_frame_to_rows(data: pd.DataFrame) -> list[tuple]:
+    """Convert a yfinance frame column-wise instead of with per-cell lookups."""
+    # multi-ticker downloads pad every symbol out to the union of all dates
+    data = data.dropna(subset=yahoo_columns, how="all")
+    values = data[yahoo_columns].to_numpy(dtype=float).tolist()
     return [
-        Stock(
-            symbol=symbol,
-            date=bar.timestamp,
-            open=bar.open,
-            high=bar.high,
-            low=bar.low,
-            close=bar.close,
-            volume=bar.volume,
-            trade_count=bar.trade_count,
-            dividend=False,
+        (date, open_, high, low, close, volume, 0)
+        for date, (open_, high, low, close, volume) in zip(
+            data.index.to_pydatetime(), values
         )
-        for bar in bars[symbol]
     ]
 
 
+def yahoo_frame_to_stocks(symbol: str, data: pd.DataFrame) -> list[Stock]:
+    return rows_to_stocks(symbol, yahoo_frame_to_rows(data))
+
+
 @retry((ReadTimeoutError,))
-def pull_from_yahoo(symbol, start, end, timeframe) -> list[Stock]:
-    yahoo_timeframes = {
-        str(TimeFrame.Day): "1d",
-        str(TimeFrame.Minute): "1m",
-        str(TimeFrame.Hour): "1h",
-    }
+def _pull_chunk_from_yahoo(symbols, start, end, timeframe) -> dict[str, list]:
     data = yfinance.download(
-        symbol, start=start, end=end, interval=yahoo_timeframes[str(timeframe)]
+        list(symbols) if len(symbols) > 1 else symbols[0],
+        start=start,
+        end=end,
+        interval=yahoo_timeframes[str(timeframe)],
+        group_by="ticker",
+        progress=False,
     )
-    return [
-        Stock(
-            symbol=symbol,
-            date=date,
-            open=float(data.loc[date, "Open"]),
-            high=float(data.loc[date, "High"]),
-            low=float(data.loc[date, "Low"]),
-            close=float(data.loc[date, "Close"]),
-            volume=float(data.loc[date, "Volume"]),
-            trade_count=0,
-            dividend=False,
-        )
-        for date in data.index
-    ]
+    if data.empty:
+        return {}
+    if not isinstance(data.columns, pd.MultiIndex):
+        return {symbols[0]: yahoo_frame_to_rows(data)}
+    downloaded = data.columns.get_level_values(0)
+    return {
+        symbol: yahoo_frame_to_rows(data[symbol])
+        for symbol in symbols
+        if symbol in downloaded
+    }
+
+
+def pull_from_yahoo(symbol, start, end, timeframe) -> list[Stock]:
+    rows = cached_rows(
+        "yahoo",
+        [symbol],
+        start,
+        end,
+        timeframe,
+        lambda symbols: _pull_chunk_from_yahoo(symbols, start, end, timeframe),
+    )
+    return rows_to_stocks(symbol, rows[symbol])
+
+
+def pull_many_from_yahoo(
+    symbols,
+    start: datetime.date,
+    end: datetime.date,
+    timeframe: TimeFrame,
+    chunk_size: int = YAHOO_SYMBOLS_PER_REQUEST,
+) -> dict[str, list[Stock]]:
+    """Download many symbols per yfinance call and split the result per symbol.
+
+    Symbols without any bars in the range are left out of the result.
+    """
+
+    def download(misses):
+        downloaded = {}
+        for i in range(0, len(misses), chunk_size):
+            downloaded.update(
+                _pull_chunk_from_yahoo(
+                    misses[i : i + chunk_size], start, end, timeframe
+                )
+            )
+        return downloaded
+
+    rows = cached_rows("yahoo", sorted(set(symbols)), start, end, timeframe, download)
+    return {
+        symbol: rows_to_stocks(symbol, symbol_rows)
+        for symbol, symbol_rows in rows.items()
+        if symbol_rows
+    }
 
 
 downloaders = [pull_from_yahoo, pull_from_alpaca]
+batch_downloaders = [pull_many_from_yahoo, pull_many_from_alpaca]
 
 
 def download_stock_data(symbol, start, end, timeframe):
-    calendar = sd.create_calendar()
-    request_end = calendar.addbusdays(end, 1)
+    request_end = sd.create_trading_days().add_business_days(end, 1)
     for downloader in downloaders:
         stock_data = downloader(symbol, start, request_end, timeframe)
         if stock_data:
             return stock_data
     return None
+
+
+def download_many_stock_data(symbols, start, end, timeframe) -> dict[str, list[Stock]]:
+    """Batched download_stock_data, each downloader only sees what is still missing."""
+    request_end = sd.create_trading_days().add_business_days(end, 1)
+    remaining = set(symbols)
+    stocks = {}
+    for downloader in batch_downloaders:
+        if not remaining:
+            break
+        found = downloader(remaining, start, request_end, timeframe)
+        stocks.update(found)
+        remaining -= found.keys()
+    return stocks
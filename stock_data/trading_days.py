@@ -0,0 +1,82 @@
+import datetime
+
+import numpy as np
+
+FIRST_DAY = datetime.date(1970, 1, 1)
+# how far past today (or the last stored holiday) the index reaches
+YEARS_AHEAD = 10
+
+
+class TradingDays:
+    """Sorted array of business days (weekdays that are not holidays).
+
+    Follows business_calendar.Calendar: holidays are the weekdays the market
+    is closed, which within the synced range is everything MarketDays lacks.
+    Every calendar day in [first, last] maps to a position in O(1) through
+    a running count, so all arithmetic is vectorized over arrays of dates.
+    Scalars in give datetime.date out, arrays give datetime64[D] arrays.
+    """
+
+    def __init__(self, holidays, first=None, last=None):
+        holidays = np.array(sorted(holidays), dtype="datetime64[D]")
+        self.first = np.datetime64(first or FIRST_DAY, "D")
+        if last is None:
+            last = max([datetime.date.today(), *holidays.astype(object)])
+            last = last.replace(year=last.year + YEARS_AHEAD, day=1)
+        self.last = np.datetime64(last, "D")
+        calendar_days = np.arange(self.first, self.last + 1)
+        self._is_business = np.is_busday(calendar_days, holidays=holidays)
+        # business days in [first, day], i.e. the position after day
+        self._through = np.cumsum(self._is_business)
+        self.days = calendar_days[self._is_business]
+
+    def __len__(self):
+        return len(self.days)
+
+    def _offsets(self, dates):
+        dates = np.asarray(dates, dtype="datetime64[D]")
+        offsets = (dates - self.first).astype(np.int64)
+        if offsets.size and (
+            offsets.min() < 0 or offsets.max() >= len(self._is_business)
+        ):
+            raise ValueError(
+                f"dates outside the trading day index {self.first} to {self.last}"
+            )
+        return dates, offsets
+
+    @staticmethod
+    def _result(values):
+        return values.item() if values.ndim == 0 else values
+
+    def is_business_day(self, dates):
+        _dates, offsets = self._offsets(dates)
+        return self._result(self._is_business[offsets])
+
+    def position(self, dates):
+        """Position of each date, or of the business day before it when closed."""
+        _dates, offsets = self._offsets(dates)
+        return self._result(self._through[offsets] - 1)
+
+    def date_at(self, positions):
+        return self._result(self.days[np.asarray(positions)])
+
+    def add_business_days(self, dates, n):
+        """Calendar.addbusdays for arrays: 0 returns the date itself, 1 is the
+        next business day and -1 the previous one, open or not."""
+        dates, offsets = self._offsets(dates)
+        n = np.asarray(n)
+        through = self._through[offsets]
+        on_or_before = through - 1
+        on_or_after = through - self._is_business[offsets]
+        positions = np.where(n > 0, on_or_before, on_or_after) + n
+        if positions.size and (positions.min() < 0 or positions.max() >= len(self)):
+            raise ValueError("business day offset runs past the trading day index")
+        shifted = self.days[np.clip(positions, 0, len(self) - 1)]
+        return self._result(np.where(n == 0, dates, shifted))
+
+    def business_days_between(self, start, end):
+        """Calendar.busdaycount: business days in (start, end], negative when
+        end is before start."""
+        _start, start_offsets = self._offsets(start)
+        _end, end_offsets = self._offsets(end)
+        return self._result(self._through[end_offsets] - self._through[start_offsets])
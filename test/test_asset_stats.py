@@ -0,0 +1,97 @@
+import datetime
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import stock_data.asset_stats as asset_stats
+from stock_data import bar_store
+from stock_data.asset_stats import compute_asset_stats
+from stock_data.models import Base, Stock
+
+
+class TestAssetStats(unittest.TestCase):
+
+    def setUp(self):
+        days = pd.date_range("2023-01-02", periods=200, freq="B")
+        market = np.random.default_rng(7).normal(0, 0.01, len(days))
+        spy = 100 * np.cumprod(1 + market)
+        self.closes = pd.DataFrame(
+            {"SPY": spy, "LEV": 50 * np.cumprod(1 + 2 * market)}, index=days
+        )
+        self.closes["NEW"] = np.nan
+        self.closes.iloc[-20:, 2] = 10.0
+        self.volumes = pd.DataFrame(1000.0, index=days, columns=self.closes.columns)
+        self.volumes.iloc[-63:, 1] = 3000.0
+
+    def test_beta_and_volume_from_aligned_bars(self):
+        stats = compute_asset_stats(self.closes, self.volumes)
+        self.assertEqual(["SPY", "LEV", "NEW"], list(stats.index))
+        self.assertAlmostEqual(2.0, stats.loc["LEV", "beta"])
+        self.assertAlmostEqual(3000.0, stats.loc["LEV", "avg_volume"])
+
+    def test_benchmark_has_its_own_volume_and_a_beta_of_one(self):
+        stats = compute_asset_stats(self.closes, self.volumes)
+        self.assertEqual(1.0, stats.loc["SPY", "beta"])
+        self.assertEqual(1000.0, stats.loc["SPY", "avg_volume"])
+
+    def test_short_history_has_no_beta(self):
+        stats = compute_asset_stats(self.closes, self.volumes)
+        self.assertTrue(np.isnan(stats.loc["NEW", "beta"]))
+
+    def test_missing_benchmark_has_no_beta(self):
+        stats = compute_asset_stats(self.closes, self.volumes, benchmark="QQQ")
+        self.assertTrue(stats["beta"].isna().all())
+
+
+@unittest.skipUnless(bar_store.available(), "pyarrow is not installed")
+class TestLoadBarFrames(unittest.TestCase):
+
+    def setUp(self):
+        engine = create_engine("sqlite:///:memory:")
+        Base.metadata.create_all(engine)
+        self.session = sessionmaker(bind=engine)()
+        self.days = [datetime.date(2023, 5, day) for day in (1, 2, 3)]
+        for symbol, close in (("SPY", 400.0), ("BRX", 20.0)):
+            self.session.add_all(
+                Stock(
+                    symbol=symbol,
+                    date=day,
+                    open=close,
+                    high=close,
+                    low=close,
+                    close=close + i,
+                    volume=1000.0,
+                    trade_count=10,
+                    dividend=False,
+                )
+                for i, day in enumerate(self.days)
+            )
+        self.session.commit()
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = bar_store.BarStore(self.directory.name)
+        self.store.export(self.session, ["SPY"])
+        patcher = mock.patch.object(asset_stats, "bar_store", return_value=self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.session.close()
+        self.directory.cleanup()
+
+    def test_stored_and_database_symbols_are_both_returned(self):
+        closes, volumes = asset_stats.load_bar_frames(
+            self.session, ["BRX", "SPY"], self.days[0], self.days[-1]
+        )
+        self.assertEqual(["BRX", "SPY"], list(closes.columns))
+        self.assertEqual([400.0, 401.0, 402.0], closes["SPY"].tolist())
+        self.assertEqual([20.0, 21.0, 22.0], closes["BRX"].tolist())
+        self.assertEqual(["BRX", "SPY"], list(volumes.columns))
+
+
+if __name__ == "__main__":
+    unittest.main()
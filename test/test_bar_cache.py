@@ -0,0 +1,81 @@
+import datetime
+import tempfile
+import unittest
+from unittest import mock
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import stock_data.fill_data as fd
+from stock_data import bar_store
+from stock_data.bar_cache import BarCache
+from stock_data.models import Base, Stock
+
+DATABASE_URL = "sqlite:///:memory:"
+
+
+def bar(symbol, day, close):
+    return Stock(
+        symbol=symbol,
+        date=datetime.date(2023, 5, day),
+        open=close,
+        high=close,
+        low=close,
+        close=close,
+        volume=1000.0,
+        trade_count=10,
+        dividend=False,
+    )
+
+
+class TestBarCache(unittest.TestCase):
+
+    def setUp(self):
+        engine = create_engine(DATABASE_URL)
+        Base.metadata.create_all(engine)
+        self.session = sessionmaker(bind=engine)()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patcher = mock.patch.object(bar_store, "BAR_STORE_DIR", directory.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.session.add_all(
+            [bar("BRX", 1, 10.0), bar("BRX", 2, 11.0), bar("KO", 1, 60.0)]
+        )
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_counts_hits_and_misses(self):
+        cache = BarCache()
+        cache.get(self.session, "BRX")
+        window = cache.bars(
+            self.session, "BRX", datetime.date(2023, 5, 2), datetime.date(2023, 5, 9)
+        )
+        self.assertEqual([11.0], window.close.tolist())
+        self.assertEqual(
+            {"hits": 1, "misses": 1, "symbols": 1},
+            {k: v for k, v in cache.stats().items() if k != "bytes"},
+        )
+
+    def test_evicts_least_recently_used_over_budget(self):
+        cache = BarCache()
+        brx = cache.get(self.session, "BRX")
+        cache.max_bytes = brx.nbytes
+        cache.get(self.session, "KO")
+        self.assertEqual(1, cache.stats()["symbols"])
+        cache.get(self.session, "KO")
+        self.assertEqual(1, cache.hits)
+
+    def test_writing_bars_invalidates_the_symbol(self):
+        cache = BarCache()
+        self.assertEqual(2, len(cache.get(self.session, "BRX")))
+        with mock.patch.object(fd, "bar_cache", return_value=cache):
+            fd.upsert_stocks(self.session, [bar("BRX", 3, 12.0)])
+        self.assertEqual(3, len(cache.get(self.session, "BRX")))
+        self.assertEqual(2, cache.misses)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import datetime
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import stock_data.fill_data as fd
+import stock_data.simulation as simulation
+from stock_data import bar_store
+from stock_data.models import Base, Stock
+from stock_data.bar_cache import BarCache
+from stock_data.simulation import SymbolBars
+
+DATABASE_URL = "sqlite:///:memory:"
+
+
+def bar(day, close):
+    return Stock(
+        symbol="BRX",
+        date=datetime.date(2023, 5, day),
+        open=close - 0.5,
+        high=close + 1,
+        low=close - 1,
+        close=close,
+        volume=1000.0,
+        trade_count=10,
+        dividend=False,
+    )
+
+
+@unittest.skipUnless(bar_store.available(), "pyarrow is not installed")
+class TestBarStore(unittest.TestCase):
+
+    def setUp(self):
+        engine = create_engine(DATABASE_URL)
+        Base.metadata.create_all(engine)
+        self.session = sessionmaker(bind=engine)()
+        self.session.add_all([bar(1, 10.0), bar(2, 11.0), bar(3, 12.0)])
+        self.session.commit()
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = bar_store.BarStore(self.directory.name)
+
+    def tearDown(self):
+        self.session.close()
+        self.directory.cleanup()
+
+    def test_export_only_rewrites_changed_symbols(self):
+        self.assertEqual(1, self.store.export(self.session))
+        self.assertEqual(0, self.store.export(self.session))
+        self.session.add(bar(4, 13.0))
+        self.session.commit()
+        self.assertEqual(1, self.store.export(self.session, ["BRX"]))
+        self.assertEqual((4, datetime.date(2023, 5, 4)), self.store.state("BRX"))
+
+    def test_reads_a_date_range_as_arrays(self):
+        self.store.export(self.session)
+        bars = SymbolBars.from_store(
+            self.store, "BRX", datetime.date(2023, 5, 2), datetime.date(2023, 5, 3)
+        )
+        self.assertEqual(
+            np.array(["2023-05-02", "2023-05-03"], dtype="datetime64[D]").tolist(),
+            bars.dates.tolist(),
+        )
+        self.assertEqual([11.0, 12.0], bars.close.tolist())
+        self.assertEqual([10.5, 11.5], bars.open.tolist())
+
+    def test_written_bars_are_not_read_from_a_stale_file(self):
+        self.store.export(self.session)
+        cache = BarCache()
+        with mock.patch.object(
+            bar_store, "BAR_STORE_DIR", self.directory.name
+        ), mock.patch.object(
+            simulation, "bar_store", return_value=self.store
+        ), mock.patch.object(
+            fd, "bar_cache", return_value=cache
+        ):
+            self.assertEqual(10.0, cache.get(self.session, "BRX").close[0])
+            fd.upsert_stocks(self.session, [bar(1, 15.0)], update=True)
+            self.assertFalse(self.store.has("BRX"))
+            self.assertEqual(15.0, cache.get(self.session, "BRX").close[0])
+        self.assertEqual(1, self.store.export(self.session))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,185 @@
+import contextlib
+import datetime
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import stock_data.best_param_search as bps
+import stock_data.database as db
+from stock_data.models import Assets, Base, Event, RiskReward
+from stock_data.pipeline import Checkpoint
+
+DATABASE_URL = "sqlite:///:memory:"
+
+
+def portion_to_risk(multiplier):
+    """A single peaked curve, best at 2.6."""
+    return 1 - (multiplier - 2.6) ** 2
+
+
+def backtest_row(multiplier):
+    win_rate = 0.5 + portion_to_risk(multiplier) / 10
+    return (win_rate, 1 - win_rate, 1.0, 1.0, 1.0, 0.25, multiplier, 0.1)
+
+
+class TestSearchStrategies(unittest.TestCase):
+
+    def run_search(self, strategy):
+        calls = []
+
+        def evaluate(multiplier):
+            calls.append(multiplier)
+            return portion_to_risk(multiplier)
+
+        strategy.search(evaluate)
+        return calls, max(calls, key=portion_to_risk)
+
+    def test_golden_section_converges_to_tolerance(self):
+        calls, best = self.run_search(bps.GoldenSectionSearch(tolerance=0.01))
+        self.assertAlmostEqual(2.6, best, delta=0.01)
+        self.assertLessEqual(len(calls), 30)
+
+    def test_bounded_brent_converges_to_tolerance(self):
+        calls, best = self.run_search(bps.BoundedBrentSearch(tolerance=0.01))
+        self.assertAlmostEqual(2.6, best, delta=0.01)
+        self.assertLess(len(calls), 15)
+
+    def test_heuristic_keeps_the_original_walk(self):
+        calls, best = self.run_search(bps.HeuristicSearch())
+        self.assertEqual([1, 2, 3, 4, 3.25, 3.5], calls)
+        self.assertEqual(3, best)
+
+
+class TestDividendMultiplierSearch(unittest.TestCase):
+
+    def setUp(self):
+        engine = create_engine(DATABASE_URL)
+        Base.metadata.create_all(engine)
+        self.session = sessionmaker(bind=engine)()
+        self.session.add(
+            Assets(symbol="BRX", start_date=datetime.date(2020, 1, 1), dividend=True)
+        )
+        self.session.commit()
+        patcher = mock.patch.object(
+            bps.fd,
+            "open_session",
+            side_effect=lambda: contextlib.nullcontext(self.session),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.session.close()
+
+    def search(self, **kwargs):
+        searcher = bps.DividendMultiplierSearch(
+            datetime.date(2020, 1, 1), datetime.date(2024, 1, 1), "golden", **kwargs
+        )
+        with mock.patch.object(
+            bps.rr,
+            "backtest_security",
+            side_effect=lambda *args: backtest_row(args[5]),
+        ) as backtest:
+            best = searcher.find("BRX")
+        return searcher, best, backtest
+
+    def test_writes_only_the_best_result(self):
+        searcher, best, backtest = self.search()
+        self.assertEqual(len(searcher.checked), backtest.call_count)
+        rows = self.session.query(RiskReward).all()
+        self.assertEqual([best], rows)
+        self.assertAlmostEqual(2.6, rows[0].div_multiplier, delta=0.05)
+
+    def test_stores_every_evaluation_when_asked(self):
+        searcher, _best, _backtest = self.search(store_intermediate=True)
+        self.assertEqual(len(searcher.checked), self.session.query(RiskReward).count())
+
+
+def failing_backtest(*args):
+    if args[3].symbol == "BAD":
+        raise ConnectionError("boom")
+    return backtest_row(args[5])
+
+
+class TestSearchSymbol(unittest.TestCase):
+
+    def test_timeout_is_not_swallowed_by_broad_handlers(self):
+        def search(session, asset):
+            try:
+                bps._on_alarm(None, None)
+            except Exception:
+                return []
+
+        searcher = mock.Mock()
+        searcher.search.side_effect = search
+        with mock.patch.object(bps, "_worker_searcher", searcher), mock.patch.object(
+            bps.fd, "open_session", return_value=contextlib.nullcontext(mock.Mock())
+        ):
+            self.assertEqual(("BRX", None), bps.search_symbol("BRX"))
+
+
+class TestSchedule(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        url = "sqlite:///" + os.path.join(self.directory.name, "stock_data.db")
+        self.env = mock.patch.dict(os.environ, {"DATABASE_URL": url})
+        self.env.start()
+        db.dispose_engine()
+        self.start = datetime.date(2020, 1, 1)
+        self.end = datetime.date(2024, 1, 1)
+        with db.open_session() as session:
+            assets = {
+                symbol: Assets(symbol=symbol, start_date=self.start)
+                for symbol in ("A", "B", "BAD")
+            }
+            assets["B"].events.extend(
+                Event(
+                    symbol="B",
+                    start_date=datetime.date(2023, month, 1),
+                    end_date=datetime.date(2023, month, 8),
+                    num_days=5,
+                )
+                for month in (3, 6)
+            )
+            session.add_all(assets.values())
+            session.commit()
+        self.checkpoint_path = os.path.join(self.directory.name, "job.checkpoint")
+
+    def tearDown(self):
+        db.dispose_engine()
+        self.env.stop()
+        self.directory.cleanup()
+
+    def test_estimates_cost_from_events(self):
+        with db.open_session() as session:
+            self.assertEqual({"B": 2}, bps.estimated_costs(session, ["A", "B", "BAD"]))
+
+    def test_writes_rows_and_resumes_failures(self):
+        checkpoint = Checkpoint(self.checkpoint_path)
+        with mock.patch.object(
+            bps.rr, "backtest_security", side_effect=failing_backtest
+        ):
+            written = bps.schedule(
+                ["A", "B", "BAD"],
+                self.start,
+                self.end,
+                "golden",
+                processes=2,
+                checkpoint=checkpoint,
+                batch_size=1,
+            )
+        self.assertEqual(2, written)
+        self.assertEqual({"A", "B"}, Checkpoint(self.checkpoint_path).done)
+        with db.open_session() as session:
+            rows = session.query(RiskReward).order_by(RiskReward.symbol).all()
+        self.assertEqual(["A", "B"], [row.symbol for row in rows])
+        self.assertAlmostEqual(2.6, rows[0].div_multiplier, delta=0.05)
+
+
+if __name__ == "__main__":
+    unittest.main()
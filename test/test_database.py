@@ -0,0 +1,41 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import stock_data.database as db
+from stock_data.models import Assets
+
+
+class TestDatabase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        url = "sqlite:///" + os.path.join(self.directory.name, "stock_data.db")
+        self.env = mock.patch.dict(os.environ, {"DATABASE_URL": url})
+        self.env.start()
+        db.dispose_engine()
+
+    def tearDown(self):
+        db.dispose_engine()
+        self.env.stop()
+        self.directory.cleanup()
+
+    def test_sessions_share_one_engine(self):
+        with db.open_session() as session:
+            self.assertEqual(0, session.query(Assets).count())
+            first = session.get_bind()
+        with db.open_session() as session:
+            self.assertIs(first, session.get_bind())
+
+    def test_schema_is_created_once(self):
+        with mock.patch.object(db.Base.metadata, "create_all") as create_all:
+            db._schema_ready.clear()
+            db.get_engine()
+            db.dispose_engine()
+            db.get_engine()
+        create_all.assert_called_once()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,457 @@
+import datetime
+import tempfile
+import unittest
+from unittest import mock
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import stock_data.fill_data as fd
+from stock_data import bar_store
+from alpaca.trading.models import Calendar as TradingCalendar
+
+from stock_data.models import (
+    Assets,
+    Base,
+    Dividends,
+    EarlyCloses,
+    Holidays,
+    MarketDays,
+    Stock,
+    SyncState,
+    event_stocks_association,
+)
+from stock_data.trading_days import TradingDays
+
+DATABASE_URL = "sqlite:///:memory:"
+
+
+def make_bar(day, close, symbol="BRX"):
+    return Stock(
+        symbol=symbol,
+        date=datetime.datetime(2023, 5, day, 4, 0),
+        open=close,
+        high=close,
+        low=close,
+        close=close,
+        volume=1000.0,
+        trade_count=10,
+        dividend=False,
+    )
+
+
+class TestUpsertStocks(unittest.TestCase):
+
+    def setUp(self):
+        engine = create_engine(DATABASE_URL)
+        Base.metadata.create_all(engine)
+        self.session = sessionmaker(bind=engine)()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patcher = mock.patch.object(bar_store, "BAR_STORE_DIR", directory.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_skips_existing_bars(self):
+        written, skipped = fd.upsert_stocks(
+            self.session, [make_bar(1, 20.0), make_bar(2, 21.0)]
+        )
+        self.assertEqual((2, 0), (written, skipped))
+
+        written, skipped = fd.upsert_stocks(
+            self.session, [make_bar(2, 99.0), make_bar(3, 22.0), make_bar(3, 22.0)]
+        )
+        self.assertEqual((1, 2), (written, skipped))
+        self.assertEqual(3, self.session.query(Stock).count())
+        bar = self.session.query(Stock).filter(Stock.date == datetime.date(2023, 5, 2))
+        self.assertEqual(21.0, bar.one().close)
+
+    def test_update_overwrites_existing_bars(self):
+        fd.upsert_stocks(self.session, [make_bar(1, 20.0)])
+        fd.upsert_stocks(self.session, [make_bar(1, 25.0)], update=True)
+        self.assertEqual(25.0, self.session.query(Stock).one().close)
+
+
+class TestFillAvgVolumeAndBeta(unittest.TestCase):
+
+    def setUp(self):
+        engine = create_engine(DATABASE_URL)
+        Base.metadata.create_all(engine)
+        self.session = sessionmaker(bind=engine)()
+        self.session.add(
+            Assets(symbol="SPY", start_date=datetime.date(2015, 1, 1), dividend=True)
+        )
+        self.session.add_all(make_bar(day, 400.0 + day, "SPY") for day in (1, 2, 3))
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_benchmark_can_be_a_dividend_asset(self):
+        with mock.patch.multiple(
+            fd,
+            open_session=mock.DEFAULT,
+            fill_missing_stock_data=mock.DEFAULT,
+        ) as patched:
+            patched["open_session"].return_value.__enter__.return_value = self.session
+            self.assertEqual(1, fd.fill_avg_volume_and_beta(datetime.date(2023, 5, 4)))
+        spy = self.session.query(Assets).one()
+        self.assertEqual((1000.0, 1.0), (spy.avg_volume, spy.beta))
+
+
+def weekdays(start, end):
+    day = start
+    while day <= end:
+        if day.weekday() < 5:
+            yield day
+        day += datetime.timedelta(days=1)
+
+
+class TestFillEventData(unittest.TestCase):
+
+    def setUp(self):
+        engine = create_engine(DATABASE_URL)
+        Base.metadata.create_all(engine)
+        self.session = sessionmaker(bind=engine)()
+        self.session.add_all(
+            MarketDays(date=day)
+            for day in weekdays(datetime.date(2023, 2, 1), datetime.date(2023, 6, 30))
+        )
+        self.asset = Assets(symbol="BRX", start_date=datetime.date(2015, 1, 1))
+        self.asset.dividends.extend(
+            Dividends(
+                symbol="BRX",
+                ex_dividend_date=day,
+                pay_date=day,
+                record_date=day,
+                declared_date=day,
+                cash_amount=0.25,
+                currency="USD",
+                frequency="4",
+                dividend_type="CD",
+            )
+            for day in (datetime.date(2023, 3, 1), datetime.date(2023, 6, 1))
+        )
+        self.session.add(self.asset)
+        self.session.commit()
+        patcher = mock.patch.object(
+            fd, "create_trading_days", return_value=TradingDays([])
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.downloads = []
+
+    def tearDown(self):
+        self.session.close()
+
+    def fake_fill_stock_data(self, dbsession, symbol, start, end, timeframe):
+        self.downloads.append((symbol, start, end))
+        dbsession.add_all(
+            Stock(
+                symbol=symbol,
+                date=day,
+                open=10.0,
+                high=10.0,
+                low=10.0,
+                close=10.0,
+                volume=1000.0,
+                trade_count=10,
+                dividend=False,
+            )
+            for day in weekdays(start, end)
+        )
+        dbsession.commit()
+
+    def fill(self):
+        with mock.patch.object(fd, "fill_stock_data", self.fake_fill_stock_data):
+            fd.fill_event_data(
+                self.session,
+                datetime.date(2023, 1, 1),
+                datetime.date(2024, 1, 1),
+                3,
+                [self.asset],
+                link_bars=True,
+            )
+
+    def test_one_download_per_asset_and_bars_linked_once(self):
+        self.fill()
+        self.assertEqual(
+            [("BRX", datetime.date(2023, 2, 23), datetime.date(2023, 5, 31))],
+            self.downloads,
+        )
+        self.fill()
+        self.assertEqual(1, len(self.downloads))
+
+        events = sorted(self.asset.events, key=lambda event: event.start_date)
+        self.assertEqual(
+            [
+                (datetime.date(2023, 2, 23), datetime.date(2023, 2, 28)),
+                (datetime.date(2023, 5, 26), datetime.date(2023, 5, 31)),
+            ],
+            [(event.start_date, event.end_date) for event in events],
+        )
+        for event in events:
+            self.assertEqual(
+                list(weekdays(event.start_date, event.end_date)),
+                sorted(bar.date for bar in event.stock_bars),
+            )
+        links = self.session.execute(event_stocks_association.select()).all()
+        self.assertEqual(8, len(links))
+        self.assertEqual(len(links), len(set(links)))
+
+    def test_relinking_adds_only_the_missing_links(self):
+        self.fill()
+        event = min(self.asset.events, key=lambda event: event.start_date)
+        del event.stock_bars[:2]
+        self.session.commit()
+        self.fill()
+        self.assertEqual(1, len(self.downloads))
+        links = self.session.execute(event_stocks_association.select()).all()
+        self.assertEqual(8, len(links))
+        self.assertEqual(len(links), len(set(links)))
+
+
+def announcement(symbol, ex_dividend_date):
+    return {
+        "ticker": symbol,
+        "ex_dividend_date": ex_dividend_date,
+        "record_date": ex_dividend_date,
+        "pay_date": ex_dividend_date,
+        "cash_amount": 0.25,
+        "currency": "USD",
+        "frequency": 4,
+        "dividend_type": "CD",
+    }
+
+
+class TestFillDividendData(unittest.TestCase):
+
+    def setUp(self):
+        engine = create_engine(DATABASE_URL)
+        Base.metadata.create_all(engine)
+        self.session = sessionmaker(bind=engine)()
+        self.start = datetime.date(2020, 1, 1)
+        self.end = datetime.date(2024, 1, 1)
+        asset = Assets(symbol="BRX", start_date=datetime.date(2015, 1, 1))
+        asset.dividends.append(
+            Dividends(
+                symbol="BRX",
+                ex_dividend_date=datetime.date(2023, 3, 1),
+                pay_date=datetime.date(2023, 3, 1),
+                record_date=datetime.date(2023, 3, 1),
+                declared_date=datetime.date(2023, 3, 1),
+                cash_amount=0.25,
+                currency="USD",
+                frequency="4",
+                dividend_type="CD",
+            )
+        )
+        self.asset = asset
+        self.session.add(asset)
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+
+    def fill(self, announcements):
+        starts = []
+
+        def fake_iter(download_starts, max_concurrency):
+            starts.append(dict(download_starts))
+            for symbol in download_starts:
+                yield symbol, announcements
+
+        with mock.patch.object(fd, "iter_dividend_announcements", fake_iter):
+            fd.fill_dividend_data(self.session, self.start, self.end, [self.asset])
+        return starts[0]
+
+    def test_downloads_after_watermark_and_advances_it(self):
+        starts = self.fill([announcement("BRX", "2023-06-01")])
+        self.assertEqual({"BRX": datetime.date(2023, 3, 1)}, starts)
+        state = self.session.query(SyncState).one()
+        self.assertEqual(datetime.date(2023, 6, 1), state.last_synced_date)
+        self.assertIsNotNone(state.last_checked_at)
+        self.assertEqual(2, self.session.query(Dividends).count())
+
+    def test_failed_download_is_neither_stored_nor_checked(self):
+        self.fill(None)
+        self.assertEqual([], self.session.query(SyncState).all())
+        self.assertEqual(
+            {"BRX": datetime.date(2023, 3, 1)},
+            self.fill([announcement("BRX", "2023-06-01")]),
+        )
+
+    def test_skips_assets_that_are_not_due(self):
+        self.fill([])
+        self.assertEqual({}, self.fill([announcement("BRX", "2023-06-01")]))
+
+    def test_store_skips_stored_and_repeated_announcements(self):
+        fd.store_dividend_announcements(
+            self.session,
+            self.asset,
+            [
+                announcement("BRX", "2023-03-01"),
+                announcement("BRX", "2023-06-01"),
+                announcement("BRX", "2023-06-01"),
+                announcement("BRX", "2024-03-01"),
+            ],
+            self.end,
+        )
+        self.assertEqual(
+            [datetime.date(2023, 3, 1), datetime.date(2023, 6, 1)],
+            sorted(d.ex_dividend_date for d in self.asset.dividends),
+        )
+        self.assertTrue(self.asset.dividend_checked)
+
+    def test_market_sync_stores_known_assets_only(self):
+        pages = [
+            [announcement("BRX", "2023-06-01"), announcement("UNKNOWN", "2023-06-01")],
+            [announcement("BRX", "2023-09-01")],
+        ]
+        with mock.patch.object(
+            fd.polygon_client, "get_dividend_pages_between", return_value=pages
+        ) as pages_between:
+            updated = fd.sync_market_dividends(self.session, self.end, self.start)
+        pages_between.assert_called_once_with(self.start, self.end)
+        self.assertEqual(1, updated)
+        self.assertEqual(
+            {"BRX"}, {d.symbol for d in self.session.query(Dividends).all()}
+        )
+        self.assertEqual(3, self.session.query(Dividends).count())
+        states = {
+            state.dataset: state.last_synced_date
+            for state in self.session.query(SyncState).all()
+        }
+        self.assertEqual(
+            {
+                fd.DIVIDENDS_DATASET: datetime.date(2023, 9, 1),
+                fd.MARKET_DIVIDENDS_DATASET: self.end,
+            },
+            states,
+        )
+
+    def test_market_sync_leaves_assets_without_history_to_backfill(self):
+        self.session.add(Assets(symbol="NEW", start_date=datetime.date(2015, 1, 1)))
+        self.session.commit()
+        pages = [[announcement("NEW", "2023-09-01")]]
+        with mock.patch.object(
+            fd.polygon_client, "get_dividend_pages_between", return_value=pages
+        ):
+            fd.sync_market_dividends(self.session, self.end, self.start)
+        state = self.session.query(SyncState).filter(SyncState.symbol == "NEW").one()
+        self.assertIsNone(state.last_synced_date)
+        self.assertIsNone(state.last_checked_at)
+        new = self.session.query(Assets).filter(Assets.symbol == "NEW").one()
+        starts = []
+
+        def fake_iter(download_starts, max_concurrency):
+            starts.append(dict(download_starts))
+            return iter(())
+
+        with mock.patch.object(fd, "iter_dividend_announcements", fake_iter):
+            fd.fill_dividend_data(self.session, self.start, self.end, [new])
+        self.assertEqual({"NEW": self.start}, starts[0])
+
+
+def trading_sessions(request):
+    sessions = []
+    day = request.start
+    while day <= request.end:
+        if day.weekday() < 5 and day != datetime.date(2023, 7, 4):
+            close = "13:00" if day == datetime.date(2023, 7, 3) else "16:00"
+            sessions.append(
+                TradingCalendar(date=day.isoformat(), open="09:30", close=close)
+            )
+        day += datetime.timedelta(days=1)
+    return sessions
+
+
+class TestSyncMarketCalendar(unittest.TestCase):
+
+    def setUp(self):
+        engine = create_engine(DATABASE_URL)
+        Base.metadata.create_all(engine)
+        self.session = sessionmaker(bind=engine)()
+        patcher = mock.patch.object(fd, "TradingClient")
+        self.client = patcher.start().return_value
+        self.client.get_calendar.side_effect = trading_sessions
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_stores_days_once_and_only_fetches_the_tail(self):
+        start = datetime.date(2023, 6, 26)
+        self.assertEqual(
+            1, fd.sync_market_calendar(self.session, start, datetime.date(2023, 7, 4))
+        )
+        self.assertEqual(
+            0, fd.sync_market_calendar(self.session, start, datetime.date(2023, 7, 4))
+        )
+        fd.sync_market_calendar(self.session, start, datetime.date(2023, 7, 7))
+
+        requested = [
+            (call.args[0].start, call.args[0].end)
+            for call in self.client.get_calendar.call_args_list
+        ]
+        self.assertEqual(
+            [
+                (start, datetime.date(2023, 7, 4)),
+                (datetime.date(2023, 7, 5), datetime.date(2023, 7, 7)),
+            ],
+            requested,
+        )
+        self.assertEqual(9, self.session.query(MarketDays).count())
+        self.assertEqual(
+            [datetime.date(2023, 7, 4)],
+            [d.date for d in self.session.query(Holidays).all()],
+        )
+        early_close = self.session.query(EarlyCloses).one()
+        self.assertEqual(datetime.date(2023, 7, 3), early_close.date)
+        self.assertEqual(datetime.time(13, 0), early_close.close_time)
+
+
+class TestResolveStartDates(unittest.TestCase):
+
+    def setUp(self):
+        engine = create_engine(DATABASE_URL)
+        Base.metadata.create_all(engine)
+        self.session = sessionmaker(bind=engine)()
+        self.session.add_all([make_bar(3, 10.0), make_bar(8, 11.0)])
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_local_sources_before_the_network(self):
+        cached = {"CACHED": datetime.date(2023, 5, 10)}
+        network = {"REMOTE": datetime.date(2023, 5, 20)}
+        with mock.patch.object(
+            fd, "cached_list_date", side_effect=cached.get
+        ), mock.patch.object(
+            fd, "network_start_date", side_effect=network.get
+        ) as network_start_date:
+            start_dates = fd.resolve_start_dates(
+                self.session,
+                ["BRX", "CACHED", "REMOTE", "GONE"],
+                datetime.date(2023, 5, 5),
+            )
+        self.assertEqual(
+            {"GONE", "REMOTE"},
+            {call.args[0] for call in network_start_date.call_args_list},
+        )
+        self.assertEqual(
+            {
+                "BRX": datetime.date(2023, 5, 5),
+                "CACHED": datetime.date(2023, 5, 10),
+                "REMOTE": datetime.date(2023, 5, 20),
+            },
+            start_dates,
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+import datetime
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from stock_data.gap_planner import plan_missing_bars, plan_window_download
+from stock_data.models import Assets, Base, MarketDays, Stock
+
+DATABASE_URL = "sqlite:///:memory:"
+
+market_days = [datetime.date(2023, 5, day) for day in (1, 2, 3, 4, 5, 8, 9, 10, 11, 12)]
+
+
+def bar(symbol, date):
+    return Stock(
+        symbol=symbol,
+        date=date,
+        open=1.0,
+        high=1.0,
+        low=1.0,
+        close=1.0,
+        volume=1.0,
+        trade_count=1,
+        dividend=False,
+    )
+
+
+class TestGapPlanner(unittest.TestCase):
+
+    def setUp(self):
+        engine = create_engine(DATABASE_URL)
+        Base.metadata.create_all(engine)
+        self.session = sessionmaker(bind=engine)()
+        self.session.add_all(MarketDays(date=day) for day in market_days)
+        # BRX is missing the 3rd, 4th and the 11th and 12th
+        self.session.add_all(
+            bar("BRX", day) for day in market_days if day.day not in (3, 4, 11, 12)
+        )
+        self.session.add_all(bar("FULL", day) for day in market_days)
+        self.session.add(Assets(symbol="NEW", start_date=datetime.date(2023, 5, 9)))
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_plans_coalesced_intervals(self):
+        plan = plan_missing_bars(
+            self.session,
+            ["BRX", "FULL", "NEW"],
+            market_days[0],
+            market_days[-1],
+            max_gap=0,
+        )
+        self.assertEqual(
+            {
+                "BRX": [
+                    (datetime.date(2023, 5, 3), datetime.date(2023, 5, 4)),
+                    (datetime.date(2023, 5, 11), datetime.date(2023, 5, 12)),
+                ],
+                "NEW": [(datetime.date(2023, 5, 9), datetime.date(2023, 5, 12))],
+            },
+            plan,
+        )
+
+    def test_merges_across_small_gaps(self):
+        plan = plan_missing_bars(
+            self.session, ["BRX"], market_days[0], market_days[-1], max_gap=5
+        )
+        self.assertEqual(
+            [(datetime.date(2023, 5, 3), datetime.date(2023, 5, 12))], plan["BRX"]
+        )
+
+    def test_window_download_ignores_days_outside_windows(self):
+        windows = [
+            (datetime.date(2023, 5, 1), datetime.date(2023, 5, 2)),
+            (datetime.date(2023, 5, 8), datetime.date(2023, 5, 11)),
+        ]
+        self.assertEqual(
+            (datetime.date(2023, 5, 11), datetime.date(2023, 5, 11)),
+            plan_window_download(self.session, "BRX", windows),
+        )
+        self.assertIsNone(plan_window_download(self.session, "FULL", windows))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+import datetime
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import stock_data.database as db
+import stock_data.pipeline as pipeline
+from stock_data.models import Assets, Dividends, SyncState
+from stock_data.pipeline import Checkpoint, run_pipeline
+
+
+class TestPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        url = "sqlite:///" + os.path.join(self.directory.name, "stock_data.db")
+        self.env = mock.patch.dict(os.environ, {"DATABASE_URL": url})
+        self.env.start()
+        db.dispose_engine()
+        self.checkpoint_path = os.path.join(self.directory.name, "job.checkpoint")
+
+    def tearDown(self):
+        db.dispose_engine()
+        self.env.stop()
+        self.directory.cleanup()
+
+    def test_writes_every_symbol_in_batches(self):
+        batches = []
+        symbols = [f"S{i}" for i in range(25)]
+        written = run_pipeline(
+            symbols,
+            lambda group: {symbol: symbol.lower() for symbol in group},
+            lambda dbsession, results: batches.append(results),
+            Checkpoint(self.checkpoint_path),
+            workers=3,
+            fetch_size=2,
+            batch_size=10,
+        )
+        self.assertEqual(25, written)
+        merged = {k: v for batch in batches for k, v in batch.items()}
+        self.assertEqual({symbol: symbol.lower() for symbol in symbols}, merged)
+        self.assertEqual(set(symbols), Checkpoint(self.checkpoint_path).done)
+
+    def test_resumes_after_failed_fetches(self):
+        def flaky(group):
+            if "BAD" in group:
+                raise ConnectionError("boom")
+            return {symbol: 1 for symbol in group}
+
+        checkpoint = Checkpoint(self.checkpoint_path)
+        run_pipeline(["A", "B", "BAD"], flaky, lambda s, r: None, checkpoint)
+        self.assertEqual({"A", "B"}, Checkpoint(self.checkpoint_path).done)
+
+        fetched = []
+        run_pipeline(
+            ["A", "B", "BAD"],
+            lambda group: fetched.extend(group) or {},
+            lambda s, r: None,
+            Checkpoint(self.checkpoint_path),
+        )
+        self.assertEqual(["BAD"], fetched)
+
+    def test_failed_write_stops_the_fetchers(self):
+        def write(dbsession, results):
+            raise RuntimeError("disk full")
+
+        with self.assertRaises(RuntimeError):
+            run_pipeline(
+                [f"S{i}" for i in range(50)],
+                lambda group: {symbol: 1 for symbol in group},
+                write,
+                workers=4,
+                batch_size=1,
+                max_pending=1,
+            )
+        self.assertEqual(
+            [],
+            [t for t in threading.enumerate() if t.name.startswith("fetcher-")],
+        )
+
+    def test_failed_dividend_download_is_retried(self):
+        start, end = datetime.date(2023, 1, 1), datetime.date(2024, 1, 1)
+        with db.open_session() as dbsession:
+            dbsession.add_all(
+                Assets(symbol=symbol, start_date=start) for symbol in ("A", "BAD")
+            )
+            dbsession.commit()
+
+        def fetch(symbol, the_day):
+            if symbol == "BAD":
+                raise ConnectionError("reset by peer")
+            return [
+                {
+                    "ticker": symbol,
+                    "ex_dividend_date": "2023-03-01",
+                    "cash_amount": 0.25,
+                    "frequency": 4,
+                    "dividend_type": "CD",
+                }
+            ]
+
+        with mock.patch.object(
+            pipeline, "CHECKPOINT_DIR", self.directory.name
+        ), mock.patch.object(pipeline, "fetch_dividend_announcements", fetch):
+            self.assertEqual(1, pipeline.pipeline_fill_dividends(start, end))
+            self.assertEqual(
+                {"A"}, pipeline.checkpoint_for("dividends", start, end).done
+            )
+        with db.open_session() as dbsession:
+            self.assertEqual(["A"], [d.symbol for d in dbsession.query(Dividends)])
+            self.assertEqual(["A"], [s.symbol for s in dbsession.query(SyncState)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,161 @@
+import asyncio
+import datetime
+import email.utils
+import functools
+import threading
+import time
+import unittest
+from unittest import mock
+
+import httpx
+
+import stock_data.polygon_client as polygon_client
+from stock_data.polygon_client import AsyncPolygonClient, retry_delay
+from stock_data.response_cache import ResponseCache
+
+DAY = datetime.date(2023, 1, 1)
+
+
+def dividends(symbol):
+    return {
+        "results": [
+            {"ticker": symbol, "ex_dividend_date": "2023-03-01", "currency": "USD"}
+        ]
+    }
+
+
+class PolygonTestCase(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(
+            polygon_client,
+            "response_cache",
+            return_value=ResponseCache(enabled=False),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def transport(self, respond):
+        def handler(request):
+            with self.lock:
+                self.requests.append(request)
+            return respond(request)
+
+        return httpx.MockTransport(handler)
+
+
+class TestRetryDelay(unittest.TestCase):
+
+    def test_retry_after_seconds_win_over_backoff(self):
+        self.assertEqual(3.0, retry_delay({"Retry-After": "3"}, 5))
+
+    def test_retry_after_http_date(self):
+        retry_at = email.utils.formatdate(time.time() + 10, usegmt=True)
+        self.assertAlmostEqual(10, retry_delay({"Retry-After": retry_at}, 0), delta=1.5)
+
+    def test_malformed_retry_after_falls_back_to_backoff(self):
+        delay = retry_delay({"Retry-After": "soon"}, 1)
+        self.assertGreaterEqual(delay, 2)
+        self.assertLess(delay, 3)
+
+    def test_backoff_is_capped(self):
+        self.assertEqual(polygon_client.MAX_BACKOFF_SECONDS, retry_delay({}, 20))
+
+
+class TestAsyncPolygonClient(PolygonTestCase):
+
+    def get_json(self, respond, max_retries=3):
+        async def run():
+            async with AsyncPolygonClient(
+                max_retries=max_retries, transport=self.transport(respond)
+            ) as client:
+                return await client.get_json("/v3/reference/dividends")
+
+        return asyncio.run(run())
+
+    def test_retries_throttled_requests_after_retry_after(self):
+        def respond(request):
+            if len(self.requests) == 1:
+                return httpx.Response(429, headers={"Retry-After": "0.2"})
+            return httpx.Response(200, json={"results": []})
+
+        started = time.monotonic()
+        self.assertEqual({"results": []}, self.get_json(respond))
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
+        self.assertEqual(2, len(self.requests))
+
+    def test_raises_once_retries_run_out(self):
+        def respond(request):
+            return httpx.Response(503, headers={"Retry-After": "0"})
+
+        with self.assertRaises(httpx.HTTPStatusError):
+            self.get_json(respond)
+        self.assertEqual(3, len(self.requests))
+
+    def test_does_not_retry_client_errors(self):
+        with self.assertRaises(httpx.HTTPStatusError):
+            self.get_json(lambda request: httpx.Response(404))
+        self.assertEqual(1, len(self.requests))
+
+    def test_transport_error_on_the_last_attempt_is_raised(self):
+        def respond(request):
+            raise httpx.ConnectError("refused", request=request)
+
+        with self.assertRaises(httpx.ConnectError):
+            self.get_json(respond, max_retries=1)
+
+
+class TestIterDividendAnnouncements(PolygonTestCase):
+
+    def iterate(self, respond, symbols, **kwargs):
+        client = functools.partial(
+            AsyncPolygonClient, transport=self.transport(respond)
+        )
+        patcher = mock.patch.object(polygon_client, "AsyncPolygonClient", client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return polygon_client.iter_dividend_announcements(
+            {symbol: DAY for symbol in symbols}, **kwargs
+        )
+
+    def respond(self, request):
+        symbol = request.url.params["ticker"]
+        if symbol == "BAD":
+            return httpx.Response(404, json={"status": "NOT_FOUND"})
+        return httpx.Response(200, json=dividends(symbol))
+
+    def test_a_failed_symbol_does_not_stop_the_others(self):
+        results = dict(self.iterate(self.respond, ["A", "BAD", "C"]))
+        self.assertIsNone(results.pop("BAD"))
+        self.assertEqual(
+            {"A": dividends("A")["results"], "C": dividends("C")["results"]}, results
+        )
+
+    def test_downloads_stay_a_bounded_distance_ahead(self):
+        symbols = [f"S{i}" for i in range(20)]
+        announcements = self.iterate(
+            self.respond, symbols, max_concurrency=1, prefetch=1
+        )
+        next(announcements)
+        time.sleep(0.3)
+        # one consumed, one queued and one waiting for room
+        self.assertLessEqual(len(self.requests), 3)
+        self.assertEqual(19, len(list(announcements)))
+
+    def test_stopping_early_ends_the_downloads(self):
+        symbols = [f"S{i}" for i in range(20)]
+        announcements = self.iterate(
+            self.respond, symbols, max_concurrency=1, prefetch=1
+        )
+        next(announcements)
+        announcements.close()
+        requested = len(self.requests)
+        time.sleep(0.2)
+        self.assertEqual(requested, len(self.requests))
+        self.assertLess(requested, len(symbols))
+
+
+if __name__ == "__main__":
+    unittest.main()
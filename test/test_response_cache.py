@@ -0,0 +1,78 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+
+from stock_data.response_cache import MISSING, ResponseCache
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = ResponseCache(self.directory.name, max_bytes=10_000, recent_ttl=60)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_fetch_only_downloads_once(self):
+        calls = []
+
+        def download():
+            calls.append(1)
+            return [("2023-05-01", 1.0)]
+
+        key = ("alpaca", "bars", "BRX", "2023-05-01", "2023-05-02", "1Day")
+        self.assertEqual(
+            self.cache.fetch(key, download), self.cache.fetch(key, download)
+        )
+        self.assertEqual(1, len(calls))
+
+    def test_recent_entries_expire(self):
+        self.cache.put(("recent",), "payload")
+        path = self.cache._path(("recent",))
+        stale = time.time() - 120
+        os.utime(path, (stale, stale))
+        self.assertIs(MISSING, self.cache.get(("recent",), recent=True))
+        self.assertEqual("payload", self.cache.get(("recent",)))
+
+    def test_hit_survives_a_concurrent_eviction(self):
+        self.cache.put(("evicted",), "payload")
+        with mock.patch.object(os, "utime", side_effect=FileNotFoundError):
+            self.assertEqual("payload", self.cache.get(("evicted",)))
+
+    def test_evicts_least_recently_used(self):
+        payload = os.urandom(4_000)
+        self.cache.put(("old",), payload)
+        old_path = self.cache._path(("old",))
+        os.utime(old_path, (time.time() - 60, time.time() - 60))
+        self.cache.put(("newer",), payload)
+        self.cache.put(("newest",), payload)
+        self.assertIs(MISSING, self.cache.get(("old",)))
+        self.assertEqual(payload, self.cache.get(("newest",)))
+        self.assertLessEqual(self.cache.size(), 10_000)
+
+    def test_leaves_other_files_in_the_directory_alone(self):
+        os.makedirs(os.path.join(self.directory.name, "bars"))
+        other = os.path.join(self.directory.name, "bars", "BRX.parquet")
+        with open(other, "wb") as f:
+            f.write(os.urandom(20_000))
+        self.cache.put(("small",), "payload")
+        self.assertEqual("payload", self.cache.get(("small",)))
+        self.cache.clear()
+        self.assertTrue(os.path.exists(other))
+        self.assertEqual(0, self.cache.size())
+
+    def test_size_stays_exact_across_threads(self):
+        cache = ResponseCache(self.directory.name, max_bytes=10_000_000)
+        self.assertEqual(0, cache.size())
+        with ThreadPoolExecutor(8) as pool:
+            list(pool.map(lambda i: cache.put((i,), os.urandom(500)), range(200)))
+        on_disk = sum(size for _mtime, size, _path in cache._entries())
+        self.assertEqual(on_disk, cache.size())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,265 @@
+import datetime
+import unittest
+from unittest import mock
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import stock_data.risk_reward as rr
+from stock_data.models import Assets, Base, Dividends, Event, RiskReward, Stock
+
+DATABASE_URL = "sqlite:///:memory:"
+
+
+def dividend(ex_dividend_date):
+    return Dividends(
+        symbol="BRX",
+        ex_dividend_date=ex_dividend_date,
+        pay_date=ex_dividend_date,
+        record_date=ex_dividend_date,
+        declared_date=ex_dividend_date,
+        cash_amount=0.25,
+        currency="USD",
+        frequency="4",
+        dividend_type="CD",
+    )
+
+
+class TestOfflineBacktest(unittest.TestCase):
+
+    def setUp(self):
+        engine = create_engine(DATABASE_URL)
+        Base.metadata.create_all(engine)
+        self.session = sessionmaker(bind=engine)()
+        self.asset = Assets(
+            symbol="BRX", start_date=datetime.date(2023, 1, 1), dividend=True
+        )
+        self.asset.dividends.extend(
+            [dividend(datetime.date(2023, 3, 1)), dividend(datetime.date(2023, 6, 1))]
+        )
+        self.window = (datetime.date(2023, 2, 21), datetime.date(2023, 2, 28))
+        self.asset.events.append(
+            Event(
+                symbol="BRX",
+                start_date=self.window[0],
+                end_date=self.window[1],
+                num_days=5,
+            )
+        )
+        self.session.add(self.asset)
+        self.session.commit()
+        self.start = datetime.date(2023, 1, 1)
+        self.end = datetime.date(2024, 1, 1)
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_reports_missing_data_without_downloading(self):
+        with mock.patch.multiple(
+            rr.fd,
+            fill_stock_data=mock.DEFAULT,
+            fill_dividend_data=mock.DEFAULT,
+            fill_event_data=mock.DEFAULT,
+        ) as fills:
+            results, reports = rr.backtest_offline(
+                self.session, self.start, self.end, [self.asset]
+            )
+        for fill in fills.values():
+            fill.assert_not_called()
+        self.assertEqual({}, results)
+        report = reports["BRX"]
+        self.assertTrue(report.dividends)
+        self.assertEqual(1, report.events)
+        self.assertEqual([self.window], report.windows)
+
+    def test_prefetch_satisfies_reports_in_bulk(self):
+        report = rr.MissingData("BRX")
+        report.windows.append(self.window)
+        with mock.patch.object(rr.fd, "fill_stock_data") as fill_stock_data:
+            rr.prefetch_missing_data(
+                self.session, self.start, self.end, [report, rr.MissingData("OK")]
+            )
+        fill_stock_data.assert_called_once_with(self.session, ["BRX"], *self.window)
+
+    def test_prefetch_downloads_dividends_from_start(self):
+        report = rr.MissingData("BRX")
+        report.dividends = True
+        with mock.patch.multiple(
+            rr.fd, fill_dividend_data=mock.DEFAULT, fill_event_data=mock.DEFAULT
+        ) as fills:
+            rr.prefetch_missing_data(self.session, self.start, self.end, [report])
+        fills["fill_dividend_data"].assert_called_once_with(
+            self.session, self.start, self.end, [self.asset], force=True
+        )
+
+    def test_offline_irregular_dividends_are_reported_not_written(self):
+        for stored in self.asset.dividends:
+            stored.dividend_type = "SC"
+        self.session.commit()
+        missing = rr.MissingData("BRX")
+        with mock.patch.object(self.session, "commit") as commit:
+            result = rr.backtest_security(
+                self.session,
+                self.start,
+                self.end,
+                self.asset,
+                offline=True,
+                missing=missing,
+            )
+        commit.assert_not_called()
+        self.assertEqual([None] * 8, result)
+        self.assertTrue(missing.irregular)
+        self.assertTrue(self.asset.dividend)
+        self.assertFalse(self.session.dirty)
+
+    def test_offline_backtest_leaves_the_asset_unchanged(self):
+        rr.backtest_security(
+            self.session, self.start, self.end, self.asset, offline=True
+        )
+        self.assertFalse(self.session.dirty)
+        self.assertEqual(0, self.asset.min_num_events)
+
+
+def bars(symbol, first, prices):
+    return [
+        Stock(
+            symbol=symbol,
+            date=first + datetime.timedelta(days=i),
+            open=price,
+            high=price + 0.1,
+            low=price - 0.1,
+            close=price,
+            volume=1000.0,
+            trade_count=10,
+            dividend=False,
+        )
+        for i, price in enumerate(prices)
+    ]
+
+
+class TestBacktestUniverse(unittest.TestCase):
+
+    def setUp(self):
+        engine = create_engine(DATABASE_URL)
+        Base.metadata.create_all(engine)
+        self.session = sessionmaker(bind=engine)()
+        self.start = datetime.date(2023, 1, 1)
+        self.end = datetime.date(2023, 7, 1)
+        self.asset = Assets(
+            symbol="BRX", start_date=self.start, dividend=True, percentage_downloaded=1
+        )
+        self.asset.dividends.extend(
+            [dividend(datetime.date(2023, 3, 1)), dividend(datetime.date(2023, 6, 1))]
+        )
+        # a window that reaches the target and one that falls through the stop
+        for first, last in (
+            ((2023, 2, 20), (2023, 2, 24)),
+            ((2023, 5, 22), (2023, 5, 26)),
+        ):
+            self.asset.events.append(
+                Event(
+                    symbol="BRX",
+                    start_date=datetime.date(*first),
+                    end_date=datetime.date(*last),
+                    num_days=5,
+                )
+            )
+        self.session.add(self.asset)
+        self.session.add_all(
+            bars("BRX", datetime.date(2023, 2, 20), [10, 10.2, 10.4, 10.6, 10.8])
+        )
+        self.session.add_all(
+            bars("BRX", datetime.date(2023, 5, 22), [20, 18.5, 17, 15.5, 14])
+        )
+        special = Assets(symbol="SPC", start_date=self.start, dividend=True)
+        special.dividends.append(dividend(datetime.date(2023, 3, 1)))
+        special.dividends[0].dividend_type = "SC"
+        short = Assets(symbol="SHT", start_date=self.start, dividend=True)
+        short.dividends.append(dividend(datetime.date(2023, 3, 1)))
+        self.session.add_all([special, short])
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_rows_match_backtest_security(self):
+        expected = rr.backtest_security(
+            self.session, self.start, self.end, self.asset, offline=True
+        )
+        written, _reports = rr.backtest_universe(
+            self.session, self.end, ["BRX"], batch_size=1
+        )
+        self.assertEqual(1, written)
+        row = self.session.query(RiskReward).one()
+        self.assertEqual(
+            (
+                expected[0],
+                expected[1],
+                expected[2],
+                expected[3],
+                expected[4],
+                expected[6],
+                expected[7],
+            ),
+            (
+                row.win_rate,
+                row.loss_rate,
+                row.avg_gain,
+                row.avg_loss,
+                row.percentage_downloaded,
+                row.div_multiplier,
+                row.stop_loss_percentage,
+            ),
+        )
+        self.assertEqual(0.25, row.avg_dividend)
+
+    def test_reports_missing_data_and_flags_irregular_dividends(self):
+        written, reports = rr.backtest_universe(
+            self.session, self.end, ["BRX", "SPC", "SHT"]
+        )
+        self.assertEqual(1, written)
+        self.assertEqual(["SHT"], list(reports))
+        self.assertTrue(reports["SHT"].dividends)
+        self.assertEqual(1, reports["SHT"].events)
+        self.session.expire_all()
+        self.assertFalse(self.session.get(Assets, 2).dividend)
+
+
+class TestGetStock(unittest.TestCase):
+
+    def setUp(self):
+        engine = create_engine(DATABASE_URL)
+        Base.metadata.create_all(engine)
+        self.session = sessionmaker(bind=engine)()
+        self.day = datetime.date(2023, 5, 1)
+        self.session.add_all(bars("BRX", self.day, [10.0, 11.0]))
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_returns_the_stored_row(self):
+        stock = rr.get_stock(self.session, "BRX", self.day, offline=True)
+        self.assertIsNotNone(stock.id)
+        self.assertEqual((10, False), (stock.trade_count, stock.dividend))
+
+    def test_prices_come_from_the_cache(self):
+        rr.purchase_price(self.session, "BRX", self.day)
+        with mock.patch.object(self.session, "query") as query:
+            self.assertEqual(
+                11.0,
+                rr.sell_price(self.session, "BRX", self.day + datetime.timedelta(1)),
+            )
+        query.assert_not_called()
+
+    def test_caches_are_kept_per_database(self):
+        engine = create_engine(DATABASE_URL)
+        Base.metadata.create_all(engine)
+        other = sessionmaker(bind=engine)()
+        self.assertEqual(10.0, rr.purchase_price(self.session, "BRX", self.day))
+        self.assertIsNone(rr.purchase_price(other, "BRX", self.day, offline=True))
+        other.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+import datetime
+import unittest
+
+import numpy as np
+
+import stock_data as sd
+from stock_data.simulation import (
+    SymbolBars,
+    evaluate_grid,
+    simulate_events,
+    trade_statistics,
+)
+from stock_data.trading_days import TradingDays
+
+
+def reference_trade(bars, start, end, cash_amount, div_multiplier, stop_loss):
+    """The day by day loop simulate_trade used to run."""
+    days = [i for i, day in enumerate(bars.dates) if start <= day <= end]
+    if not days:
+        return 0
+    beginning_price = bars.open[days[0]]
+    profit_price = sd.convert_to_currency(
+        div_multiplier * cash_amount + beginning_price
+    )
+    stop_loss_price = sd.convert_to_currency(beginning_price * (1 - stop_loss))
+    for i in days:
+        if bars.high[i] >= profit_price:
+            return profit_price - beginning_price
+        elif bars.low[i] <= stop_loss_price:
+            return stop_loss_price - beginning_price
+    return bars.close[days[-1]] - beginning_price + cash_amount
+
+
+class TestSimulation(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(3)
+        dates = np.arange("2023-01-02", "2023-06-30", dtype="datetime64[D]")
+        dates = dates[np.is_busday(dates)]
+        close = 20 + np.cumsum(rng.normal(0, 0.3, len(dates)))
+        open = close + rng.normal(0, 0.1, len(dates))
+        self.bars = SymbolBars(
+            dates,
+            open,
+            np.maximum(open, close) + rng.uniform(0, 0.4, len(dates)),
+            np.minimum(open, close) - rng.uniform(0, 0.4, len(dates)),
+            close,
+        )
+        self.starts = dates[5:-10:7]
+        self.ends = self.starts + 6
+        self.cash = rng.uniform(0.1, 0.5, len(self.starts))
+
+    def test_matches_day_by_day_loop(self):
+        for multiplier in (0.5, 1, 2):
+            for stop_loss in (0.005, 0.02, 0.1):
+                gains = simulate_events(
+                    self.bars, self.starts, self.ends, self.cash, multiplier, stop_loss
+                )
+                expected = [
+                    reference_trade(self.bars, *event, multiplier, stop_loss)
+                    for event in zip(self.starts, self.ends, self.cash)
+                ]
+                np.testing.assert_allclose(expected, gains)
+
+    def test_parameter_grid_broadcasts(self):
+        multipliers = np.array([0.5, 1, 2])[:, None, None]
+        stop_losses = np.array([0.005, 0.1])[:, None]
+        gains = simulate_events(
+            self.bars, self.starts, self.ends, self.cash, multipliers, stop_losses
+        )
+        self.assertEqual((3, 2, len(self.starts)), gains.shape)
+        np.testing.assert_allclose(
+            simulate_events(self.bars, self.starts, self.ends, self.cash, 2, 0.005),
+            gains[2, 0],
+        )
+
+    def test_grid_rows_match_single_runs(self):
+        trading_days = TradingDays([])
+        ex_dates = self.ends + 1
+        table = evaluate_grid(
+            self.bars, trading_days, ex_dates, self.cash, [1, 2], [0.01, 0.1], [3, 5]
+        )
+        self.assertEqual(8, len(table))
+        row = table[
+            (table.div_multiplier == 2)
+            & (table.stop_loss_percentage == 0.01)
+            & (table.holding_days == 3)
+        ].iloc[0]
+        sell = trading_days.add_business_days(ex_dates, -1)
+        buy = trading_days.add_business_days(sell, -3)
+        gains = simulate_events(self.bars, buy, sell, self.cash, 2, 0.01)
+        expected = trade_statistics(gains, self.bars.open_on(buy))
+        for name, value in expected.items():
+            self.assertAlmostEqual(float(value), row[name], msg=name)
+
+    def test_target_wins_a_day_touching_both(self):
+        bars = SymbolBars(["2023-05-01"], [10.0], [12.0], [5.0], [10.0])
+        day = datetime.date(2023, 5, 1)
+        self.assertAlmostEqual(
+            0.5, simulate_events(bars, [day], [day], [0.5], 1, 0.1)[0]
+        )
+
+    def test_window_without_bars_gains_nothing(self):
+        weekend = np.array(["2023-01-07"], dtype="datetime64[D]")
+        self.assertEqual(
+            [0.0], simulate_events(self.bars, weekend, weekend, [0.5]).tolist()
+        )
+        self.assertTrue(np.isnan(self.bars.open_on(weekend)[0]))
+
+
+if __name__ == "__main__":
+    unittest.main()
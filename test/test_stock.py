@@ -9,7 +9,7 @@ from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
 import stock_data.models
-from stock_data.models import Base, Stock, Dividends
+from stock_data.models import Base, Stock, Dividends, Assets, Event
 
 DATABASE_URL = "sqlite:///:memory:"
 
@@ -113,6 +113,28 @@ class TestStock(unittest.TestCase):
         )
         self.assertEqual(len(filtered_rows), len(stocks))
 
+    def test_event_bars_follow_date_range(self):
+        asset = Assets(symbol="BRX", start_date=datetime.date(2010, 1, 1))
+        asset.events.append(
+            Event(
+                symbol="BRX",
+                start_date=datetime.date(2023, 4, 28),
+                end_date=datetime.date(2023, 5, 3),
+                num_days=3,
+            )
+        )
+        self.session.add(asset)
+        self.session.commit()
+        event = asset.events[0]
+        in_range = (
+            self.session.query(Stock)
+            .filter(Stock.date.between(event.start_date, event.end_date))
+            .order_by(Stock.date)
+            .all()
+        )
+        self.assertEqual(4, len(in_range))
+        self.assertEqual(in_range, event.bars)
+
 
 class TestDividends(unittest.TestCase):
 
@@ -0,0 +1,220 @@
+import datetime
+import tempfile
+import types
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+import stock_data.stock_downloads as downloads
+from stock_data.response_cache import ResponseCache
+from stock_data.stock_downloads import cached_rows, yahoo_frame_to_stocks
+from stock_data.trading_days import TradingDays
+
+
+class TestYahooFrameToStocks(unittest.TestCase):
+
+    def test_converts_columns_and_drops_padding_rows(self):
+        index = pd.DatetimeIndex(["2023-05-01", "2023-05-02", "2023-05-03"])
+        data = pd.DataFrame(
+            {
+                "Open": [21.22, np.nan, 20.88],
+                "High": [21.41, np.nan, 21.05],
+                "Low": [21.05, np.nan, 20.62],
+                "Close": [21.10, np.nan, 20.97],
+                "Adj Close": [20.11, np.nan, 19.99],
+                "Volume": [1879000, np.nan, 1762100],
+            },
+            index=index,
+        )
+        stocks = yahoo_frame_to_stocks("BRX", data)
+        self.assertEqual(2, len(stocks))
+        self.assertEqual(datetime.date(2023, 5, 3), stocks[1].date.date())
+        self.assertEqual(20.88, stocks[1].open)
+        self.assertEqual(1762100.0, stocks[1].volume)
+        self.assertIsInstance(stocks[0].close, float)
+
+
+class TestCachedRows(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        patcher = mock.patch.object(
+            downloads,
+            "response_cache",
+            return_value=ResponseCache(self.directory.name),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.calls = []
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def rows(self, **kwargs):
+        def download(symbols):
+            self.calls.append(list(symbols))
+            return {"BRX": [("2023-05-01", 1.0)]}
+
+        return cached_rows(
+            "yahoo",
+            ["BRX", "GONE"],
+            datetime.date(2023, 5, 1),
+            datetime.date(2023, 5, 2),
+            "1Day",
+            download,
+            **kwargs,
+        )
+
+    def test_empty_answers_are_asked_for_again(self):
+        self.assertEqual({"BRX": [("2023-05-01", 1.0)], "GONE": []}, self.rows())
+        self.rows()
+        self.assertEqual([["BRX", "GONE"], ["GONE"]], self.calls)
+
+    def test_empty_answers_are_kept_when_the_provider_raises_on_errors(self):
+        self.rows(cache_empty=True)
+        self.rows(cache_empty=True)
+        self.assertEqual([["BRX", "GONE"]], self.calls)
+
+
+def alpaca_bar(day, close):
+    return types.SimpleNamespace(
+        timestamp=datetime.datetime(2023, 5, day),
+        open=close,
+        high=close,
+        low=close,
+        close=close,
+        volume=1000.0,
+        trade_count=10,
+    )
+
+
+class TestPullManyFromAlpaca(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.requests = []
+        client = mock.Mock()
+        client.get_stock_bars.side_effect = self.get_stock_bars
+        for name, value in (
+            ("response_cache", ResponseCache(self.directory.name)),
+            ("alpaca_data_client", client),
+        ):
+            patcher = mock.patch.object(downloads, name, return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.start = datetime.date(2023, 5, 1)
+        self.end = datetime.date(2023, 5, 3)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def get_stock_bars(self, request):
+        self.requests.append(list(request.symbol_or_symbols))
+        # Alpaca leaves symbols without bars out of the response
+        return types.SimpleNamespace(
+            data={
+                symbol: [alpaca_bar(1, 10.0), alpaca_bar(2, 11.0)]
+                for symbol in request.symbol_or_symbols
+                if not symbol.startswith("NONE")
+            }
+        )
+
+    def test_chunks_requests_and_splits_bars_per_symbol(self):
+        symbols = ["A", "B", "C", "NONE", "E"]
+        stocks = downloads.pull_many_from_alpaca(
+            symbols, self.start, self.end, downloads.TimeFrame.Day, chunk_size=2
+        )
+        self.assertEqual([["A", "B"], ["C", "E"], ["NONE"]], self.requests)
+        self.assertEqual({"A", "B", "C", "E"}, set(stocks))
+        self.assertEqual(["C", "C"], [stock.symbol for stock in stocks["C"]])
+        self.assertEqual([10.0, 11.0], [stock.close for stock in stocks["C"]])
+
+    def test_cached_symbols_are_not_requested_again(self):
+        args = (self.start, self.end, downloads.TimeFrame.Day)
+        downloads.pull_many_from_alpaca(["A", "NONE"], *args)
+        downloads.pull_many_from_alpaca(["A", "B", "NONE"], *args)
+        self.assertEqual([["A", "NONE"], ["B"]], self.requests)
+
+    def test_download_many_only_asks_alpaca_for_what_yahoo_missed(self):
+        yahoo = mock.Mock(return_value={"A": ["bar"]})
+        with mock.patch.object(
+            downloads, "batch_downloaders", [yahoo, downloads.pull_many_from_alpaca]
+        ), mock.patch.object(
+            downloads.sd, "create_trading_days", return_value=TradingDays([])
+        ):
+            stocks = downloads.download_many_stock_data(
+                ["A", "B", "NONE"], self.start, self.end, downloads.TimeFrame.Day
+            )
+        self.assertEqual({"A", "B"}, set(stocks))
+        self.assertEqual(datetime.date(2023, 5, 4), yahoo.call_args.args[2])
+        self.assertEqual([["B", "NONE"]], self.requests)
+
+
+def yahoo_frame(prices: dict) -> pd.DataFrame:
+    """A group_by="ticker" download, every ticker padded to the shared dates."""
+    index = pd.DatetimeIndex(["2023-05-01", "2023-05-02", "2023-05-03"])
+    return pd.concat(
+        {
+            symbol: pd.DataFrame(
+                {column: closes for column in downloads.yahoo_columns}, index=index
+            )
+            for symbol, closes in prices.items()
+        },
+        axis=1,
+    )
+
+
+class TestPullManyFromYahoo(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        patcher = mock.patch.object(
+            downloads, "response_cache", return_value=ResponseCache(self.directory.name)
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.requests = []
+        self.args = (
+            datetime.date(2023, 5, 1),
+            datetime.date(2023, 5, 4),
+            downloads.TimeFrame.Day,
+        )
+
+    def download(self, tickers, **kwargs):
+        self.requests.append(tickers)
+        return yahoo_frame(
+            {
+                "A": [10.0, 11.0, 12.0],
+                "B": [20.0, np.nan, 22.0],
+                "DEAD": [np.nan, np.nan, np.nan],
+            }
+        )
+
+    def test_splits_the_ticker_frame_per_symbol(self):
+        with mock.patch.object(
+            downloads.yfinance, "download", side_effect=self.download
+        ):
+            stocks = downloads.pull_many_from_yahoo(["B", "A", "DEAD"], *self.args)
+        self.assertEqual([["A", "B", "DEAD"]], self.requests)
+        self.assertEqual({"A", "B"}, set(stocks))
+        self.assertEqual(["A"] * 3, [stock.symbol for stock in stocks["A"]])
+        self.assertEqual([10.0, 11.0, 12.0], [stock.close for stock in stocks["A"]])
+        self.assertEqual(
+            [datetime.date(2023, 5, 1), datetime.date(2023, 5, 3)],
+            [stock.date.date() for stock in stocks["B"]],
+        )
+        self.assertEqual([20.0, 22.0], [stock.open for stock in stocks["B"]])
+
+    def test_symbols_missing_from_the_frame_are_left_out(self):
+        with mock.patch.object(
+            downloads.yfinance, "download", side_effect=self.download
+        ):
+            stocks = downloads.pull_many_from_yahoo(["A", "GONE"], *self.args)
+        self.assertEqual({"A"}, set(stocks))
+
+
+if __name__ == "__main__":
+    unittest.main()
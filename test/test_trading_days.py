@@ -0,0 +1,66 @@
+import datetime
+import unittest
+import warnings
+
+import numpy as np
+from business_calendar import Calendar
+
+from stock_data.trading_days import TradingDays
+
+holidays = [
+    datetime.date(2023, 1, 2),
+    datetime.date(2023, 1, 16),
+    datetime.date(2023, 7, 4),
+    datetime.date(2023, 12, 25),
+    datetime.date(2024, 1, 1),
+]
+
+
+class TestTradingDays(unittest.TestCase):
+
+    def setUp(self):
+        self.trading_days = TradingDays(holidays)
+        self.calendar = Calendar(holidays=holidays)
+        self.days = [
+            datetime.date(2023, 6, 1) + datetime.timedelta(days=i) for i in range(60)
+        ]
+
+    def test_matches_addbusdays(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            for n in (-10, -1, 0, 1, 3):
+                expected = [self.calendar.addbusdays(day, n) for day in self.days]
+                shifted = self.trading_days.add_business_days(self.days, n)
+                self.assertEqual(expected, shifted.tolist(), n)
+
+    def test_scalar_dates(self):
+        # the 4th of July falls on a Tuesday, Saturday + 1 is Monday the 3rd
+        self.assertEqual(
+            datetime.date(2023, 7, 5),
+            self.trading_days.add_business_days(datetime.date(2023, 7, 3), 1),
+        )
+        self.assertEqual(
+            datetime.date(2023, 7, 3),
+            self.trading_days.add_business_days(datetime.date(2023, 7, 1), 1),
+        )
+        self.assertEqual(
+            datetime.date(2023, 7, 4),
+            self.trading_days.add_business_days(datetime.date(2023, 7, 4), 0),
+        )
+
+    def test_matches_busdaycount(self):
+        start = datetime.date(2023, 6, 15)
+        expected = [self.calendar.busdaycount(start, day) for day in self.days]
+        counts = self.trading_days.business_days_between(start, self.days)
+        self.assertEqual(expected, counts.tolist())
+
+    def test_position_round_trip(self):
+        days = np.array(["2023-07-03", "2023-07-05"], dtype="datetime64[D]")
+        positions = self.trading_days.position(days)
+        self.assertEqual([1], np.diff(positions).tolist())
+        self.assertTrue((self.trading_days.date_at(positions) == days).all())
+        self.assertFalse(self.trading_days.is_business_day(datetime.date(2023, 7, 4)))
+
+
+if __name__ == "__main__":
+    unittest.main()